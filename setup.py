@@ -62,7 +62,7 @@ setup(
         'django-bootstrap3',
         'django-zxcvbn-password',
         'getconf',
-    ],
+    ] + (['futures'] if sys.version_info < (3,) else []),  # Backport of concurrent.futures
     setup_requires=[
         'setuptools>=0.8',
     ],
@@ -66,3 +66,19 @@ class AccountsModelTests(TestCase):
         alias.email = 'Louis.Vaneau@polytechnique.org'
         with self.assertRaises(ValidationError):
             alias.full_clean()
+
+    def test_alias_local_part(self):
+        """Test that saving an alias keeps its local part up to date"""
+        user = User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            fullname='Louis Vaneau',
+            preferred_name='Louis Vaneau',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password='Depuis Vaneau!'
+        )
+        alias = UserAlias(user=user, email='louis.vaneau@polytechnique.org')
+        alias.save()
+        self.assertEqual('louis.vaneau', UserAlias.objects.get(pk=alias.pk).local_part)
+        alias.email = 'vaneau@melix.net'
+        alias.save()
+        self.assertEqual('vaneau', UserAlias.objects.get(pk=alias.pk).local_part)
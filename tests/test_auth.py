@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import crypt
+import hashlib
 import sys
+import threading
+import unittest
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
 
 from django.contrib import auth
 from django.core import mail
-from django.test import Client, TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 from django.utils import translation
+from django.utils.six import StringIO
 
-from xorgauth.accounts.models import User, UserAlias
+from xorgauth.accounts import login_cache, passwords, throttling
+from xorgauth.accounts.hashers import PBKDF2WrappedSHA1PasswordHasher
+from xorgauth.accounts.models import AMBIGUOUS_LOGIN, UNKNOWN_LOGIN, GoogleAppsPassword, User, UserAlias
+from xorgauth.utils import deferred
+from xorgauth.utils.sha512_crypt import sha512_crypt
 import xorgauth.forms
 
 
@@ -145,12 +160,263 @@ class AuthenticationTests(TestCase):
         self.assertEqual(None, User.objects.get_for_login('louis.vaneau.29', True))
         self.assertFalse(c.login(username='louis.vaneau.29', password='Depuis Vaneau!'))
 
+    def test_auth_lookup_single_query(self):
+        """Resolving a login uses only one query, even with fallbacks"""
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vaneau, User.objects.get_for_login('LOUIS.VANEAU.29', True))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vaneau, User.objects.get_for_login('Vaneau@Melix.net', True))
+        with self.assertNumQueries(1):
+            self.assertIsNone(User.objects.get_for_login('Louis.Vaneau.1830', True))
+
+    def test_auth_unknown_login_cache(self):
+        """Unknown logins are remembered until an account is created"""
+        with self.assertNumQueries(1):
+            self.assertIsNone(User.objects.get_for_login('louis.vaneau.1830', True))
+        with self.assertNumQueries(0):
+            self.assertIsNone(User.objects.get_for_login('Louis.Vaneau.1830', True))
+        homonym = User.objects.create_user(
+            hrid='louis.vaneau.1830',
+            main_email='louis.vaneau.1830@polytechnique.org',
+            password='Depuis Vaneau again!'
+        )
+        self.assertEqual(homonym, User.objects.get_for_login('louis.vaneau.1830', True))
+
+        self.assertIsNone(User.objects.get_for_login('louis.vaneau@melix.net', True))
+        UserAlias(user=self.vaneau, email='louis.vaneau@melix.net').save()
+        self.assertEqual(self.vaneau, User.objects.get_for_login('louis.vaneau@melix.net', True))
+
+    @override_settings(LOGIN_NEGATIVE_CACHE_TIMEOUT=0)
+    def test_auth_unknown_login_cache_disabled(self):
+        self.assertIsNone(User.objects.get_for_login('louis.vaneau.1830', True))
+        with self.assertNumQueries(1):
+            self.assertIsNone(User.objects.get_for_login('louis.vaneau.1830', True))
+
+    @override_settings(LOGIN_CACHE_TIMEOUT=60, LOGIN_CACHE_STATS=True)
+    def test_auth_login_cache(self):
+        """Known logins are mapped to user IDs until accounts or aliases change"""
+        login_cache.invalidate()
+        stats = login_cache.get_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vaneau, User.objects.get_for_login('louis.vaneau', True))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vaneau, User.objects.get_for_login('Louis.Vaneau', True))
+        new_stats = login_cache.get_stats()
+        self.assertEqual(stats['hits'] + 1, new_stats['hits'])
+        self.assertEqual(stats['misses'] + 1, new_stats['misses'])
+
+        # Logging in does not invalidate the cache
+        self.assertTrue(Client().login(username='louis.vaneau', password='Depuis Vaneau!'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vaneau, User.objects.get_for_login('louis.vaneau', True))
+
+        # Deleting an alias invalidates the cache
+        UserAlias.objects.get(email='louis.vaneau@polytechnique.org').delete()
+        UserAlias.objects.get(email='louis.vaneau@m4x.org').delete()
+        self.assertIsNone(User.objects.get_for_login('louis.vaneau', True))
+
+        # Deactivating the user is taken into account
+        self.assertEqual(self.vaneau, User.objects.get_for_login('louis.vaneau.1829', True))
+        User.objects.filter(pk=self.vaneau.pk).update(is_active=False)
+        self.assertIsNone(User.objects.get_for_login('louis.vaneau.1829', True))
+
+    def test_auth_login_cache_invalidated_on_commit(self):
+        """The login cache is invalidated again once the changes are committed"""
+        with mock.patch('xorgauth.accounts.signals.transaction.on_commit') as mock_on_commit:
+            UserAlias(user=self.vaneau, email='louis.vaneau@melix.net').save()
+        mock_on_commit.assert_called_once_with(login_cache.invalidate)
+
+    @override_settings(LOGIN_CACHE_TIMEOUT=60)
+    def test_auth_login_cache_concurrent_change(self):
+        """The result of a lookup is not cached when the accounts changed after it started"""
+        generation, cached = login_cache.lookup('louis.vaneau.1830')
+        self.assertIsNone(cached)
+        login_cache.invalidate()
+        login_cache.remember_unknown_login('louis.vaneau.1830', generation)
+        self.assertIsNone(login_cache.lookup('louis.vaneau.1830')[1])
+
+    @override_settings(LOGIN_CACHE_TIMEOUT=60)
+    def test_auth_login_cache_evicted_generation(self):
+        """Entries do not become valid again when the generation is evicted from the cache"""
+        homonym = User.objects.create_user(
+            hrid='louis.vaneau.1830',
+            main_email='louis.vaneau.1830@polytechnique.org',
+            password='Depuis Vaneau again!'
+        )
+        login_cache._get_cache().delete(login_cache.GENERATION_KEY)
+        self.assertEqual(self.vaneau, User.objects.get_for_login('vaneau@melix.net', True))
+        # Move the alias without sending signals, and evict the generation
+        UserAlias.objects.filter(email='vaneau@melix.net').update(user=homonym)
+        login_cache._get_cache().delete(login_cache.GENERATION_KEY)
+        # Another lookup sets a new generation
+        self.assertIsNone(User.objects.get_for_login('louis.vaneau.1831', True))
+        with self.assertNumQueries(1):
+            self.assertEqual(homonym, User.objects.get_for_login('vaneau@melix.net', True))
+
+    def test_resolve_logins(self):
+        """Resolve many logins at once"""
+        homonym = User.objects.create_user(
+            hrid='louis.vaneau.1830',
+            main_email='louis.vaneau.1830@polytechnique.org',
+            password='Depuis Vaneau again!',
+            is_active=False,
+        )
+        UserAlias(user=homonym, email='louis.vaneau@m4x.net').save()
+        UserAlias(user=homonym, email='lvaneau@melix.net').save()
+        with self.assertNumQueries(1):
+            results = User.objects.resolve_logins([
+                'louis.vaneau.1829',
+                'Louis.Vaneau.29',
+                'vaneau@melix.net',
+                'louis.vaneau.1830@polytechnique.org',
+                'lvaneau',
+                'louis.vaneau',
+                'louis.vaneau.1831',
+            ], True)
+        self.assertEqual({
+            'louis.vaneau.1829': self.vaneau,
+            'Louis.Vaneau.29': self.vaneau,
+            'vaneau@melix.net': self.vaneau,
+            'louis.vaneau.1830@polytechnique.org': UNKNOWN_LOGIN,
+            'lvaneau': UNKNOWN_LOGIN,
+            'louis.vaneau': AMBIGUOUS_LOGIN,
+            'louis.vaneau.1831': UNKNOWN_LOGIN,
+        }, results)
+        self.assertEqual(homonym, User.objects.resolve_logins(['lvaneau'], False)['lvaneau'])
+
+    @override_settings(AUTH_PASSWORD_CHECK_LIMIT=1)
+    def test_auth_password_check_limit(self):
+        """Password verifications are refused when too many are in progress"""
+        c = Client()
+        self.assertTrue(c.login(username='louis.vaneau.1829', password='Depuis Vaneau!'))
+        self.assertFalse(c.login(username='louis.vaneau.1829', password='Wrong password'))
+
+        # Occupy the only slot, as a verification in another process would
+        with passwords.verification_slot():
+            resp = c.post('/accounts/login/', {
+                'username': 'louis.vaneau.1829',
+                'password': 'Depuis Vaneau!',
+                'expiry': 'now',
+            })
+            self.assertEqual(429, resp.status_code)
+            self.assertEqual('1', resp['Retry-After'])
+        self.assertTrue(c.login(username='louis.vaneau.1829', password='Depuis Vaneau!'))
+
+    @override_settings(AUTH_EQUALIZE_TIMING=True)
+    def test_auth_equalize_timing(self):
+        """Login attempts for unknown users wait as long as password verifications"""
+        c = Client()
+        self.assertFalse(c.login(username='louis.vaneau.1829', password='Wrong password'))
+        with mock.patch('xorgauth.accounts.passwords.time.sleep') as mock_sleep:
+            self.assertFalse(c.login(username='louis.vaneau.1830', password='Depuis Vaneau!'))
+        mock_sleep.assert_called_once()
+        self.assertIn(mock_sleep.call_args[0][0], passwords._durations)
+
+    def test_auth_no_equalize_timing(self):
+        with mock.patch('xorgauth.accounts.passwords.time.sleep') as mock_sleep:
+            self.assertFalse(Client().login(username='louis.vaneau.1830', password='Depuis Vaneau!'))
+        mock_sleep.assert_not_called()
+
+    @override_settings(LOGIN_THROTTLE_PER_LOGIN=3, LOGIN_THROTTLE_PER_IP=5)
+    def test_auth_throttling(self):
+        """Failed login attempts are throttled by login and by IP address"""
+        caches['logins'].clear()
+        c = Client()
+        for _ in range(3):
+            self.assertFalse(c.login(username='louis.vaneau.1829', password='Wrong password'))
+        resp = c.post('/accounts/login/', {
+            'username': 'Louis.Vaneau.1829',
+            'password': 'Depuis Vaneau!',
+            'expiry': 'now',
+        })
+        self.assertEqual(429, resp.status_code)
+        self.assertGreater(int(resp['Retry-After']), 0)
+
+        # Other logins are not throttled, until too many attempts failed from the same IP address
+        c = Client(REMOTE_ADDR='192.0.2.1')
+        self.assertTrue(c.login(username='louis.vaneau.29', password='Depuis Vaneau!'))
+        for login in ('louis.vaneau.1830', 'louis.vaneau.1831'):
+            resp = c.post('/accounts/login/', {'username': login, 'password': 'Wrong', 'expiry': 'now'})
+            self.assertEqual(200, resp.status_code)
+        self.assertTrue(c.login(username='louis.vaneau.29', password='Depuis Vaneau!'))
+        for login in ('louis.vaneau.1832', 'louis.vaneau.1833', 'louis.vaneau.1834'):
+            resp = c.post('/accounts/login/', {'username': login, 'password': 'Wrong', 'expiry': 'now'})
+            self.assertEqual(200, resp.status_code)
+        resp = c.post('/accounts/login/', {'username': 'louis.vaneau.29', 'password': 'Depuis Vaneau!'})
+        self.assertEqual(429, resp.status_code)
+
+    @override_settings(LOGIN_THROTTLE_PER_LOGIN=0, LOGIN_THROTTLE_PER_IP=2, TRUSTED_PROXIES=1)
+    def test_auth_throttling_behind_proxy(self):
+        """Behind a reverse proxy, attempts are counted by the forwarded client IP address"""
+        caches['logins'].clear()
+        proxied = Client(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.7, 192.0.2.1')
+        for login in ('louis.vaneau.1830', 'louis.vaneau.1831'):
+            resp = proxied.post('/accounts/login/', {'username': login, 'password': 'Wrong', 'expiry': 'now'})
+            self.assertEqual(200, resp.status_code)
+        resp = proxied.post('/accounts/login/', {'username': 'louis.vaneau.29', 'password': 'Depuis Vaneau!'})
+        self.assertEqual(429, resp.status_code)
+
+        # Another client behind the same proxy is not throttled, even if it forges the header
+        other = Client(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='192.0.2.1, 192.0.2.2')
+        resp = other.post('/accounts/login/', {
+            'username': 'louis.vaneau.29',
+            'password': 'Depuis Vaneau!',
+            'expiry': 'now',
+        })
+        self.assertEqual(302, resp.status_code)
+
+    @override_settings(LOGIN_THROTTLE_PER_LOGIN=3, LOGIN_THROTTLE_WINDOW=900)
+    def test_auth_throttling_counter_timeout(self):
+        """The counters of failed attempts are kept until the end of the next window"""
+        mock_cache = mock.Mock()
+        mock_cache.incr.return_value = 2
+        with mock.patch.object(throttling, '_get_cache', return_value=mock_cache):
+            throttling.record_failure(None, 'louis.vaneau.1829')
+            mock_cache.incr.side_effect = ValueError
+            throttling.record_failure(None, 'louis.vaneau.1829')
+        key = mock_cache.incr.call_args[0][0]
+        self.assertEqual([mock.call(key, 2, 1800), mock.call(key, 1, 1800)], mock_cache.set.call_args_list)
+
+    def test_auth_upgrade_wrapped_sha1_password(self):
+        """Legacy password hashes are upgraded after the response to the login request"""
+        hasher = PBKDF2WrappedSHA1PasswordHasher()
+        self.vaneau.password = hasher.encode_sha1_hash(hashlib.sha1(b'Depuis Vaneau!').hexdigest())
+        self.vaneau.save()
+        out = StringIO()
+        call_command('passwordhashstats', stdout=out)
+        self.assertIn('pbkdf2_wrapped_sha1: 1 (1 to be upgraded at next login)', out.getvalue())
+
+        c = Client()
+        upgraded = []
+        post_save.connect(lambda sender, **kwargs: upgraded.append(kwargs['update_fields']), sender=User,
+                          dispatch_uid='test_upgrade', weak=False)
+        try:
+            resp = c.post('/accounts/login/', {
+                'username': 'louis.vaneau.1829',
+                'password': 'Depuis Vaneau!',
+                'expiry': 'now',
+            })
+        finally:
+            post_save.disconnect(sender=User, dispatch_uid='test_upgrade')
+        self.assertEqual(302, resp.status_code)
+        self.assertEqual([frozenset(['last_login']), frozenset(['password'])], upgraded)
+        self.vaneau.refresh_from_db()
+        self.assertTrue(self.vaneau.password.startswith('pbkdf2_sha256$'))
+
+        # The session is still valid
+        self.assertEqual(self.vaneau, auth.get_user(c))
+        out = StringIO()
+        call_command('passwordhashstats', stdout=out)
+        self.assertIn('pbkdf2_sha256: 1\n', out.getvalue())
+        self.assertIn('Total to be upgraded: 0/1', out.getvalue())
+
+    @override_settings(DEFERRED_TASKS_EAGER=True)
     def test_googleapps_password(self):
         """Test setting the Google Apps password when setting the password"""
         self.vaneau.set_password('Depuis Vaneau!')
         self.vaneau.save()
         gapps_password = self.vaneau.gapps_password.password
-        self.assertEqual(crypt.crypt('Depuis Vaneau!', gapps_password), gapps_password)
+        self.assertEqual(sha512_crypt('Depuis Vaneau!', gapps_password), gapps_password)
 
         password = 'Mot de passe différent?'
         self.vaneau.set_password(password)
@@ -159,7 +425,7 @@ class AuthenticationTests(TestCase):
         gapps_password = self.vaneau.gapps_password.password
         if sys.version_info < (3,):
             password = password.encode('utf-8')
-        self.assertEqual(crypt.crypt(password, gapps_password), gapps_password)
+        self.assertEqual(sha512_crypt(password, gapps_password), gapps_password)
 
     def test_password_reset_form(self):
         """Test using the password reset form"""
@@ -249,3 +515,110 @@ class AuthenticationTests(TestCase):
         c.post('/accounts/login/', {'username': 'louis.vaneau.1829', 'password': 'Depuis Vaneau!', 'expiry': 'now'})
         self.assertTrue(auth.get_user(c).is_authenticated)
         self.assertTrue(c.session.get_expire_at_browser_close())
+
+
+# Hash the Google Apps passwords before the database is flushed at the end of the tests
+@unittest.skipIf(sys.version_info < (3, 5), "asynchronous authentication requires Python >= 3.5")
+@override_settings(DEFERRED_TASKS_EAGER=True)
+class AsyncAuthenticationTests(TransactionTestCase):
+    def setUp(self):
+        self.vaneau = User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password='Depuis Vaneau!'
+        )
+        UserAlias(user=self.vaneau, email='louis.vaneau@polytechnique.org').save()
+
+    @staticmethod
+    def run_async(coroutine):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_aget_for_login(self):
+        from xorgauth.accounts.async_authentication import aget_for_login
+        self.assertEqual(self.vaneau, self.run_async(aget_for_login('Louis.Vaneau', True)))
+        self.assertIsNone(self.run_async(aget_for_login('louis.vaneau.1830', True)))
+
+    @override_settings(AUTHENTICATION_BACKENDS=['xorgauth.accounts.async_authentication.AsyncXorgBackend'])
+    def test_aauthenticate(self):
+        from xorgauth.accounts.async_authentication import aauthenticate
+        user = self.run_async(aauthenticate(username='louis.vaneau', password='Depuis Vaneau!'))
+        self.assertEqual(self.vaneau, user)
+        self.assertEqual('xorgauth.accounts.async_authentication.AsyncXorgBackend', user.backend)
+        self.assertIsNone(self.run_async(aauthenticate(username='louis.vaneau', password='Wrong password')))
+        self.assertIsNone(self.run_async(aauthenticate(username='louis.vaneau.1830', password='Depuis Vaneau!')))
+
+        # Synchronous authentication still works
+        self.assertTrue(Client().login(username='louis.vaneau', password='Depuis Vaneau!'))
+
+    @override_settings(AUTHENTICATION_BACKENDS=['xorgauth.accounts.async_authentication.AsyncXorgBackend'])
+    def test_aauthenticate_upgrade_failure(self):
+        """Failures of the password upgrades run in the background are logged"""
+        import asyncio
+        from xorgauth.accounts import async_authentication
+
+        async def authenticate_and_wait(mock_logger):
+            user = await async_authentication.aauthenticate(username='louis.vaneau', password='Depuis Vaneau!')
+            for _ in range(100):
+                if mock_logger.error.called:
+                    break
+                await asyncio.sleep(0.01)
+            return user
+
+        with mock.patch.object(passwords, 'verify', return_value=(True, True)), \
+                mock.patch.object(passwords, 'upgrade_password', side_effect=RuntimeError("Database is down")), \
+                mock.patch.object(async_authentication, 'logger') as mock_logger:
+            self.assertEqual(self.vaneau, self.run_async(authenticate_and_wait(mock_logger)))
+        mock_logger.error.assert_called_once()
+        self.assertIsInstance(mock_logger.error.call_args[1]['exc_info'], RuntimeError)
+
+
+class DeferredGoogleAppsPasswordTests(TransactionTestCase):
+    def test_googleapps_password_after_commit(self):
+        """The Google Apps password is hashed in the background after the transaction commits"""
+        with transaction.atomic():
+            vaneau = User.objects.create_user(
+                hrid='louis.vaneau.1829',
+                main_email='louis.vaneau.1829@polytechnique.org',
+                password='Depuis Vaneau!'
+            )
+            deferred.wait_for_tasks()
+            self.assertFalse(GoogleAppsPassword.objects.filter(user=vaneau).exists())
+        deferred.wait_for_tasks()
+        gapps_password = GoogleAppsPassword.objects.get(user=vaneau).password
+        self.assertEqual(sha512_crypt('Depuis Vaneau!', gapps_password), gapps_password)
+
+    def test_defer_in_order(self):
+        """Tasks with the same key run in the order they were deferred, even with several workers"""
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def first_task():
+            started.set()
+            release.wait(5)
+            results.append(1)
+
+        deferred.defer_in_order('key', first_task)
+        self.assertTrue(started.wait(5))
+        deferred.defer_in_order('key', results.append, 2)
+        release.set()
+        deferred.wait_for_tasks()
+        self.assertEqual([1, 2], results)
+
+    @override_settings(DEFERRED_TASKS_EXIT_TIMEOUT=0)
+    def test_deferred_tasks_at_exit(self):
+        """The tasks which did not complete when the process exits are reported"""
+        release = threading.Event()
+        deferred.defer(release.wait, 5)
+        try:
+            with mock.patch.object(deferred.logger, 'warning') as warning:
+                deferred._wait_at_exit()
+            warning.assert_called_once_with("Exiting with %d deferred tasks which did not complete", 1)
+        finally:
+            release.set()
+        self.assertEqual(0, deferred.wait_for_tasks())
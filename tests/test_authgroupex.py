@@ -3,15 +3,22 @@ from __future__ import unicode_literals
 import hashlib
 import random
 import struct
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
 
 import django
 from django import http
 import django.contrib.auth
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from xorgauth.accounts.models import User, UserAlias, Role, Group, GroupMembership
-from xorgauth.authgroupex.models import AuthGroupeXClient
+from xorgauth.authgroupex import client_registry
+from xorgauth.authgroupex.checks import check_client_cache
+from xorgauth.authgroupex.models import AuthGroupeXClient, extract_return_host
 import xorgauth.authgroupex.views as authgroupex_views
 
 
@@ -321,6 +328,149 @@ class AuthGroupeXTests(TestCase):
                 'sex': 'male',
             })
 
+    def test_extract_return_host(self):
+        """Clients whose return URLs only match a single host are indexed by this host"""
+        self.assertEqual('example.com', self.client_simple.return_host)
+        for pattern, host in (
+            (r'#https://example\.com/#', 'example.com'),
+            (r'#^https?://(www\.)?Example\.org/path#', 'example.org'),
+            (r'(http|https)://sub-1\.example\.net$', 'sub-1.example.net'),
+            (r'https\:\/\/example\.com\/', 'example.com'),
+            # Patterns which can match several hosts
+            (r'#^https?://(dev|preprod|www)\.example\.(net|org)/#', ''),
+            (r'#https://example.com/#', ''),
+            (r'#https://example\.com#', ''),
+            (r'#^https?://example\.com/?#', ''),
+            (r'#^https?://example\.com\/*#', ''),
+            (r'#https://example\.com/|https://example\.net/#', ''),
+            (r'#https://[a-z]+\.example\.com/#', ''),
+            (r'.*', ''),
+        ):
+            self.assertEqual(host, extract_return_host(pattern), "error for pattern %r" % pattern)
+
+    def test_client_lookup(self):
+        """Only the clients which can match the host of the URL are checked"""
+        www_client = AuthGroupeXClient.objects.create(
+            privkey='da4b9237bacccdf19c0760cab7aec4a8359010b0',  # SHA1("2")
+            name='Test client with www',
+            data_fields='forlife',
+            return_urls=r'#^https://(www\.)?example\.org/#',
+        )
+        wildcard_client = AuthGroupeXClient.objects.create(
+            privkey='77de68daecd823babbb58edb1c8e14d7106e83bb',  # SHA1("3")
+            name='Test client with several hosts',
+            data_fields='forlife',
+            return_urls=r'#^https://(dev|www)\.example\.net/#',
+        )
+        for client, url, other_client in (
+            (self.client_simple, 'https://example.com/', www_client),
+            (www_client, 'https://example.org/', self.client_simple),
+            (www_client, 'https://www.example.org/', self.client_simple),
+            (wildcard_client, 'https://dev.example.net/', www_client),
+        ):
+            _, challenge = self._get_req_url(client.privkey, url)
+            signature = hashlib.md5((challenge + client.privkey).encode('ascii')).hexdigest()
+            with self.assertNumQueries(1):
+                self.assertEqual(client, AuthGroupeXClient.objects.get_by_url_and_challenge(
+                    url, challenge, signature))
+            # The clients with the literal host of other URLs are not checked
+            with mock.patch.object(AuthGroupeXClient, 'match_return_url', autospec=True,
+                                   side_effect=AuthGroupeXClient.match_return_url) as mock_match:
+                AuthGroupeXClient.objects.get_by_url_and_challenge(url, challenge, signature)
+            checked_clients = [call[0][0] for call in mock_match.call_args_list]
+            self.assertIn(client, checked_clients)
+            self.assertNotIn(other_client, checked_clients)
+
+        # A pattern with an optional "/" after the host also matches longer hosts
+        prefix_client = AuthGroupeXClient.objects.create(
+            privkey='1b6453892473a467d07372d45eb05abc2031647a',  # SHA1("4")
+            name='Test client with an optional slash',
+            data_fields='forlife',
+            return_urls=r'#^https?://example\.info/?#',
+        )
+        url = 'https://example.info.example.net/'
+        _, challenge = self._get_req_url(prefix_client.privkey, url)
+        signature = hashlib.md5((challenge + prefix_client.privkey).encode('ascii')).hexdigest()
+        self.assertEqual(prefix_client, AuthGroupeXClient.objects.get_by_url_and_challenge(url, challenge, signature))
+
+    def test_return_urls_regex_cache(self):
+        """The patterns of return URLs are only compiled when they change"""
+        client = AuthGroupeXClient.objects.get(pk=self.client_simple.pk)
+        regex = client.get_return_urls_regex()
+        self.assertTrue(AuthGroupeXClient.objects.get(pk=client.pk).match_return_url('https://example.com/'))
+        self.assertFalse(AuthGroupeXClient.objects.get(pk=client.pk).match_return_url('https://example.org/'))
+        self.assertIs(regex, AuthGroupeXClient.objects.get(pk=client.pk).get_return_urls_regex())
+
+        client.return_urls = r'#https://example\.org/#'
+        client.save()
+        self.assertIsNot(regex, AuthGroupeXClient.objects.get(pk=client.pk).get_return_urls_regex())
+        self.assertTrue(AuthGroupeXClient.objects.get(pk=client.pk).match_return_url('https://example.org/'))
+
+    def test_client_registry(self):
+        """The clients are only loaded again from the database when they change"""
+        url = 'https://example.com/'
+        _, challenge = self._get_req_url(self.client_simple.privkey, url)
+        signature = hashlib.md5((challenge + self.client_simple.privkey).encode('ascii')).hexdigest()
+        client = client_registry.get_by_url_and_challenge(url, challenge, signature)
+        self.assertEqual(self.client_simple.pk, client.pk)
+        self.assertEqual(('matricule_ax', 'nom', 'prenom', 'full_promo', 'forlife', 'sex'), client.data_fields)
+        with self.assertNumQueries(0):
+            self.assertIs(client, client_registry.get_by_url_and_challenge(url, challenge, signature))
+
+        self.client_simple.allow_xnet = True
+        self.client_simple.save()
+        with self.assertNumQueries(1):
+            client = client_registry.get_by_url_and_challenge(url, challenge, signature)
+        self.assertTrue(client.allow_xnet)
+
+        self.client_simple.delete()
+        self.assertIsNone(client_registry.get_by_url_and_challenge(url, challenge, signature))
+
+    def test_client_registry_reload(self):
+        """The clients are loaded again when the version is evicted from the cache, or when they are too old"""
+        url = 'https://example.com/'
+        _, challenge = self._get_req_url(self.client_simple.privkey, url)
+        signature = hashlib.md5((challenge + self.client_simple.privkey).encode('ascii')).hexdigest()
+        client_registry._get_cache().delete(client_registry.VERSION_KEY)
+        self.assertFalse(client_registry.get_by_url_and_challenge(url, challenge, signature).allow_xnet)
+
+        # Change the client without sending signals, and evict the version
+        AuthGroupeXClient.objects.filter(pk=self.client_simple.pk).update(allow_xnet=True)
+        client_registry._get_cache().delete(client_registry.VERSION_KEY)
+        with self.assertNumQueries(1):
+            self.assertTrue(client_registry.get_by_url_and_challenge(url, challenge, signature).allow_xnet)
+
+        AuthGroupeXClient.objects.filter(pk=self.client_simple.pk).update(allow_xnet=False)
+        with override_settings(AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE=0):
+            with self.assertNumQueries(1):
+                self.assertFalse(client_registry.get_by_url_and_challenge(url, challenge, signature).allow_xnet)
+
+    def test_client_cache_check(self):
+        """A cache which is not shared between processes is reported, unless the clients are always loaded"""
+        with override_settings(AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE=60):
+            self.assertEqual(['authgroupex.W001'], [error.id for error in check_client_cache(None)])
+        with override_settings(AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE=0):
+            self.assertEqual([], check_client_cache(None))
+        with override_settings(CACHES={'logins': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                  'LOCATION': '/tmp/xorgauth-test-cache'}}):
+            self.assertEqual([], check_client_cache(None))
+
+    def test_client_last_used(self):
+        """The date of the last use of a client is only written once per day"""
+        url = 'https://example.com/'
+        _, challenge = self._get_req_url(self.client_simple.privkey, url)
+        signature = hashlib.md5((challenge + self.client_simple.privkey).encode('ascii')).hexdigest()
+        client = client_registry.get_by_url_and_challenge(url, challenge, signature)
+        with self.assertNumQueries(1):
+            client.update_last_used()
+        with self.assertNumQueries(0):
+            client.update_last_used()
+        self.client_simple.refresh_from_db()
+        self.assertEqual(timezone.localdate(), self.client_simple.last_used)
+        # The update does not make the processes load the clients again
+        with self.assertNumQueries(0):
+            self.assertIs(client, client_registry.get_by_url_and_challenge(url, challenge, signature))
+
     def test_logout_request(self):
         c = Client()
         self.assertTrue(c.login(username='louis.vaneau.1829', password='Depuis Vaneau!'))
@@ -1,10 +1,20 @@
+import collections
 import datetime
+import io
 import json
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
 
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
 
-from xorgauth.accounts.models import User
+from xorgauth.accounts import axsync
+from xorgauth.accounts.models import AxSyncChange, AxSyncJob, AxSyncJobChunk, AxSyncSession, User
 
 
 # crypt("secret")
@@ -14,7 +24,30 @@ CRYPT_SECRET = (
 )
 
 
+def vaneau_hrid(i):
+    return 'louis.vaneau.%d' % (1820 + i)
+
+
+def create_vaneau_users(count, **fields):
+    """Create the accounts louis.vaneau.1820, louis.vaneau.1821...
+
+    The fields given as lists have one value per account.
+    """
+    return [
+        User.objects.create_user(
+            hrid=vaneau_hrid(i),
+            main_email='%s@polytechnique.org' % vaneau_hrid(i),
+            password=None,
+            **{name: value[i] if isinstance(value, list) else value for name, value in fields.items()}
+        )
+        for i in range(count)
+    ]
+
+
 class ViewTests(TestCase):
+    def setUp(self):
+        axsync.forget_verified_secret()
+
     def test_no_sget(self):
         """The view for AX synchronisation only supports POST"""
         c = Client()
@@ -37,6 +70,29 @@ class ViewTests(TestCase):
         )
         self.assertEqual(403, resp.status_code)
 
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_verified_secret_cache(self):
+        """The crypt hash of the secret is only computed until the secret has been verified"""
+        with mock.patch('xorgauth.accounts.axsync.sha512_crypt', wraps=axsync.sha512_crypt) as mock_crypt:
+            self.assertTrue(axsync.check_secret('secret'))
+            self.assertTrue(axsync.check_secret('secret'))
+            self.assertEqual(1, mock_crypt.call_count)
+            # Wrong secrets are always checked against the hash
+            self.assertFalse(axsync.check_secret('bad'))
+            self.assertFalse(axsync.check_secret('bad'))
+            self.assertEqual(3, mock_crypt.call_count)
+
+        # The verified secret is forgotten when the configured hash changes
+        with override_settings(AX_SYNC_SECRET_CRYPT='$6$saltstring$invalid'):
+            self.assertFalse(axsync.check_secret('secret'))
+
+        axsync.forget_verified_secret()
+        with override_settings(AX_SYNC_SECRET_CACHE_TIMEOUT=0):
+            with mock.patch('xorgauth.accounts.axsync.sha512_crypt', wraps=axsync.sha512_crypt) as mock_crypt:
+                self.assertTrue(axsync.check_secret('secret'))
+                self.assertTrue(axsync.check_secret('secret'))
+                self.assertEqual(2, mock_crypt.call_count)
+
     @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
     def test_bad_json(self):
         c = Client()
@@ -140,3 +196,447 @@ class ViewTests(TestCase):
         self.assertEqual(200, resp.status_code)
         user.refresh_from_db()
         self.assertEqual(False, user.axjr_subscriber)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_sync_many_users(self):
+        """Users are fetched and updated in bulk, only when they changed"""
+        create_vaneau_users(10, alumnforce_id=[str(i) for i in range(10)], ax_contributor=False)
+        data = [
+            {
+                'xorg_id': vaneau_hrid(i),
+                'af_id': i,
+                'ax_contributor': i % 2 == 0,
+                'last_updated': '1830-01-23',
+            }
+            for i in range(10)
+        ]
+        data.append({'xorg_id': 'unexisting.user.1942', 'af_id': 42})
+        c = Client()
+        # Transaction, select, update, insert of the change log and commit
+        with self.assertNumQueries(5):
+            resp = c.post(
+                reverse('sync-ax-data'),
+                content_type='text/plain',
+                data=json.dumps({'secret': 'secret', 'data': data}),
+            )
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(b"Sync OK: 10 updated, 0 unchanged, 1 unknown", resp.content)
+        self.assertEqual(5, User.objects.filter(ax_contributor=True).count())
+        self.assertEqual(10, User.objects.filter(ax_last_synced=datetime.date(1830, 1, 23)).count())
+
+        # Nothing is written when nothing changed
+        with self.assertNumQueries(3):
+            resp = c.post(
+                reverse('sync-ax-data'),
+                content_type='text/plain',
+                data=json.dumps({'secret': 'secret', 'data': data[:5]}),
+            )
+        self.assertEqual(b"Sync OK: 0 updated, 5 unchanged, 0 unknown", resp.content)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_sync_invalid_data(self):
+        """Invalid data does not partially update the accounts"""
+        User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password=None,
+        )
+        c = Client()
+        resp = c.post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data=json.dumps({'secret': 'secret', 'data': [
+                {'xorg_id': 'louis.vaneau.1829', 'ax_contributor': True},
+                {'xorg_id': 'louis.vaneau.1829', 'last_updated': 'not a date'},
+            ]}),
+        )
+        self.assertEqual(400, resp.status_code)
+        self.assertIsNone(User.objects.get(hrid='louis.vaneau.1829').ax_contributor)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_sync_stream(self):
+        """The entries are synced by batches while the request is read"""
+        create_vaneau_users(5)
+        entries = [{'xorg_id': vaneau_hrid(i), 'ax_contributor': True} for i in range(5)]
+        body = json.dumps({'secret': 'secret', 'data': entries}).encode('ascii')
+        with mock.patch('xorgauth.accounts.axsync.sync_batch', wraps=axsync.sync_batch) as mock_sync_batch:
+            stats = axsync.sync_stream(io.BytesIO(body), batch_size=2, chunk_size=10)
+        self.assertEqual(3, mock_sync_batch.call_count)
+        self.assertEqual({'updated': 5, 'unchanged': 0, 'unknown': 0}, dict(stats))
+        self.assertEqual(5, User.objects.filter(ax_contributor=True).count())
+
+        # The data can be sent before the secret
+        body = json.dumps(collections.OrderedDict([
+            ('data', entries),
+            ('secret', 'secret'),
+        ])).encode('ascii')
+        stats = axsync.sync_stream(io.BytesIO(body), batch_size=2, chunk_size=10)
+        self.assertEqual({'updated': 0, 'unchanged': 5, 'unknown': 0}, dict(stats))
+
+        body = json.dumps(collections.OrderedDict([
+            ('data', entries),
+            ('secret', 'bad'),
+        ])).encode('ascii')
+        self.assertIsNone(axsync.sync_stream(io.BytesIO(body)))
+
+    @override_settings(
+        AX_SYNC_SECRET_CRYPT=CRYPT_SECRET,
+        DATA_UPLOAD_MAX_MEMORY_SIZE=1000,
+        AX_SYNC_MAX_REQUEST_SIZE=5000,
+    )
+    def test_sync_request_size(self):
+        """The data which are kept in memory until the secret is checked, and the requests, are limited"""
+        create_vaneau_users(1)
+        entries = [{'xorg_id': vaneau_hrid(0), 'ax_contributor': True}] * 20
+        c = Client()
+        resp = c.post(reverse('sync-ax-data'), content_type='text/plain', data=json.dumps(collections.OrderedDict([
+            ('data', entries * 2),
+            ('secret', 'bad'),
+        ])))
+        self.assertEqual(400, resp.status_code)
+        self.assertIsNone(User.objects.get(hrid=vaneau_hrid(0)).ax_contributor)
+
+        # The limit of Django is not used when the secret comes first
+        resp = c.post(reverse('sync-ax-data'), content_type='text/plain', data=json.dumps(collections.OrderedDict([
+            ('secret', 'secret'),
+            ('data', entries * 2),
+        ])))
+        self.assertEqual(200, resp.status_code)
+        resp = c.post(reverse('sync-ax-data'), content_type='text/plain', data=json.dumps(collections.OrderedDict([
+            ('secret', 'secret'),
+            ('data', entries * 10),
+        ])))
+        self.assertEqual(400, resp.status_code)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_sync_truncated_request(self):
+        """A truncated request is rejected without applying any entry"""
+        User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password=None,
+        )
+        c = Client()
+        resp = c.post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data='{"secret": "secret", "data": [{"xorg_id": "louis.vaneau.1829", "ax_contributor": true}, {"xorg_',
+        )
+        self.assertEqual(400, resp.status_code)
+        self.assertIsNone(User.objects.get(hrid='louis.vaneau.1829').ax_contributor)
+
+        resp = c.post(reverse('sync-ax-data'), content_type='text/plain', data='{"secret": "secret"}')
+        self.assertEqual(400, resp.status_code)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_watermark(self):
+        """The data provider can query the most recent synced update, and older entries are skipped"""
+        c = Client()
+        resp = c.post(reverse('sync-ax-watermark'), content_type='text/plain', data=json.dumps({'secret': 'bad'}))
+        self.assertEqual(403, resp.status_code)
+        resp = c.post(reverse('sync-ax-watermark'), content_type='text/plain', data=json.dumps({'secret': 'secret'}))
+        self.assertEqual({'last_synced': None, 'synced_accounts': 0}, resp.json())
+
+        create_vaneau_users(3, ax_last_synced=[datetime.date(1830, 1, 23), datetime.date(1831, 2, 1), None])
+        resp = c.post(reverse('sync-ax-watermark'), content_type='text/plain', data=json.dumps({'secret': 'secret'}))
+        self.assertEqual({'last_synced': '1831-02-01', 'synced_accounts': 2}, resp.json())
+
+        resp = c.post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data=json.dumps({'secret': 'secret', 'data': [
+                # Older than the last sync
+                {'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True, 'last_updated': '1830-01-22'},
+                {'xorg_id': 'louis.vaneau.1821', 'ax_contributor': True, 'last_updated': '1830-12-31'},
+                # Same day as the last sync, which may be a second update of this day
+                {'xorg_id': 'louis.vaneau.1821', 'axjr_subscribed': True, 'last_updated': '1831-02-01'},
+                # More recent
+                {'xorg_id': 'louis.vaneau.1820', 'axjr_subscribed': True, 'last_updated': '1830-01-24'},
+                {'xorg_id': 'louis.vaneau.1822', 'ax_contributor': True, 'last_updated': '1800-01-01'},
+            ]}),
+        )
+        self.assertEqual(b"Sync OK: 3 updated, 2 unchanged, 0 unknown", resp.content)
+        users = {user.hrid: user for user in User.objects.all()}
+        self.assertIsNone(users['louis.vaneau.1820'].ax_contributor)
+        self.assertTrue(users['louis.vaneau.1820'].axjr_subscriber)
+        self.assertEqual(datetime.date(1830, 1, 24), users['louis.vaneau.1820'].ax_last_synced)
+        self.assertIsNone(users['louis.vaneau.1821'].ax_contributor)
+        self.assertTrue(users['louis.vaneau.1821'].axjr_subscriber)
+        self.assertTrue(users['louis.vaneau.1822'].ax_contributor)
+
+    @override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+    def test_change_log(self):
+        """The changes are recorded in bulk, in the transaction of the sync"""
+        user = User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password=None,
+            alumnforce_id='1234',
+            ax_contributor=False,
+        )
+        c = Client()
+        # Transaction, select, update, insert and commit
+        with self.assertNumQueries(5):
+            resp = c.post(
+                reverse('sync-ax-data'),
+                content_type='text/plain',
+                data=json.dumps({'secret': 'secret', 'data': [
+                    {
+                        'xorg_id': 'louis.vaneau.1829',
+                        'af_id': 89,
+                        'ax_contributor': True,
+                        'axjr_subscribed': None,
+                        'last_updated': '1830-01-23',
+                    },
+                ]}),
+            )
+        self.assertEqual(200, resp.status_code)
+        changes = AxSyncChange.objects.filter(user=user).order_by('field')
+        self.assertEqual([
+            (AxSyncChange.ALUMNFORCE_ID, '1234', '89'),
+            (AxSyncChange.AX_CONTRIBUTOR, '0', '1'),
+            (AxSyncChange.AX_LAST_SYNCED, None, '1830-01-23'),
+        ], [(change.field, change.old_value, change.new_value) for change in changes])
+        self.assertEqual(1, len(set(change.sync_id for change in changes)))
+
+        # Invalid data does not leave any record
+        resp = c.post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data=json.dumps({'secret': 'secret', 'data': [
+                {'xorg_id': 'louis.vaneau.1829', 'ax_contributor': False, 'last_updated': '1830-01-24'},
+                {'xorg_id': 'louis.vaneau.1829', 'last_updated': 'not a date'},
+            ]}),
+        )
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual(3, AxSyncChange.objects.count())
+
+    def test_prune_log(self):
+        user = User.objects.create_user(
+            hrid='louis.vaneau.1829',
+            main_email='louis.vaneau.1829@polytechnique.org',
+            password=None,
+        )
+        session = AxSyncSession.objects.create()
+        old_change = AxSyncChange.objects.create(sync_id=session.uid, user=user, field=AxSyncChange.AX_CONTRIBUTOR)
+        AxSyncChange.objects.create(sync_id=session.uid, user=user, field=AxSyncChange.AXJR_SUBSCRIBER)
+        AxSyncChange.objects.filter(pk=old_change.pk).update(date=timezone.now() - datetime.timedelta(days=40))
+        out = StringIO()
+        call_command('pruneaxsynclog', days=30, stdout=out)
+        self.assertEqual("Deleted 1 change records, 0 sessions and 0 jobs older than 30 days\n", out.getvalue())
+        self.assertEqual([AxSyncChange.AXJR_SUBSCRIBER], list(AxSyncChange.objects.values_list('field', flat=True)))
+
+        AxSyncSession.objects.filter(pk=session.pk).update(created=timezone.now() - datetime.timedelta(days=40))
+        out = StringIO()
+        call_command('pruneaxsynclog', days=30, stdout=out)
+        self.assertEqual("Deleted 0 change records, 1 sessions and 0 jobs older than 30 days\n", out.getvalue())
+
+
+@override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET)
+class SessionTests(TestCase):
+    """Test the synchronisation in several batches"""
+    def setUp(self):
+        axsync.forget_verified_secret()
+        create_vaneau_users(4)
+        self.client = Client()
+
+    def post(self, url, data):
+        return self.client.post(url, content_type='application/json', data=json.dumps(data))
+
+    def post_batch(self, session_uid, number, entries, secret='secret'):
+        url = reverse('sync-ax-session-batch', kwargs={'session_uid': session_uid, 'number': number})
+        return self.post(url, {'secret': secret, 'data': entries})
+
+    def test_session(self):
+        resp = self.post(reverse('sync-ax-session-open'), {'secret': 'secret'})
+        self.assertEqual(201, resp.status_code)
+        session_uid = resp.json()['session']
+        self.assertEqual([], resp.json()['batches'])
+
+        resp = self.post_batch(session_uid, 1, [
+            {'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True},
+            {'xorg_id': 'louis.vaneau.1821', 'ax_contributor': True},
+        ])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({'number': 1, 'updated': 2, 'unchanged': 0, 'unknown': 0}, resp.json())
+        self.assertEqual(2, User.objects.filter(ax_contributor=True).count())
+
+        # A failed batch does not apply anything and can be sent again
+        resp = self.client.post(
+            reverse('sync-ax-session-batch', kwargs={'session_uid': session_uid, 'number': 2}),
+            content_type='application/json',
+            data='{"secret": "secret", "data": [{"xorg_id": "louis.vaneau.1822", "ax_contributor": true}, {',
+        )
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual(2, User.objects.filter(ax_contributor=True).count())
+
+        resp = self.post(reverse('sync-ax-session-commit', kwargs={'session_uid': session_uid}), {
+            'secret': 'secret',
+            'batches': 2,
+        })
+        self.assertEqual(409, resp.status_code)
+        self.assertEqual({'missing': [2]}, resp.json())
+
+        resp = self.post_batch(session_uid, 2, [
+            {'xorg_id': 'louis.vaneau.1822', 'ax_contributor': True},
+            {'xorg_id': 'louis.vaneau.1823', 'ax_contributor': None},
+            {'xorg_id': 'unexisting.user.1942', 'ax_contributor': True},
+        ])
+        self.assertEqual({'number': 2, 'updated': 1, 'unchanged': 1, 'unknown': 1}, resp.json())
+
+        # Sending a batch again does not change its statistics
+        resp = self.post_batch(session_uid, 1, [{'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True}])
+        self.assertEqual({'number': 1, 'updated': 2, 'unchanged': 0, 'unknown': 0}, resp.json())
+
+        resp = self.post(reverse('sync-ax-session', kwargs={'session_uid': session_uid}), {'secret': 'secret'})
+        self.assertEqual(200, resp.status_code)
+        self.assertIsNone(resp.json()['committed'])
+        self.assertEqual([1, 2], [batch['number'] for batch in resp.json()['batches']])
+
+        resp = self.post(reverse('sync-ax-session-commit', kwargs={'session_uid': session_uid}), {
+            'secret': 'secret',
+            'batches': 2,
+        })
+        self.assertEqual(200, resp.status_code)
+        self.assertIsNotNone(resp.json()['committed'])
+        self.assertEqual({'updated': 3, 'unchanged': 1, 'unknown': 1}, resp.json()['total'])
+        self.assertIsNotNone(AxSyncSession.objects.get(uid=session_uid).committed)
+
+        # No batch is accepted after the commit, and nothing is applied
+        with mock.patch.object(axsync, 'sync_accounts') as sync_accounts:
+            resp = self.post_batch(session_uid, 3, [{'xorg_id': 'louis.vaneau.1823', 'ax_contributor': True}])
+        self.assertEqual(409, resp.status_code)
+        self.assertFalse(sync_accounts.called)
+        self.assertEqual(3, User.objects.filter(ax_contributor=True).count())
+
+    def test_session_authentication(self):
+        resp = self.post(reverse('sync-ax-session-open'), {'secret': 'bad'})
+        self.assertEqual(403, resp.status_code)
+        self.assertEqual(0, AxSyncSession.objects.count())
+
+        # The session is not locked for unauthenticated requests
+        session = AxSyncSession.objects.create()
+        with mock.patch.object(AxSyncSession.objects, 'select_for_update') as select_for_update:
+            resp = self.post_batch(session.uid, 1, [{'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True}], 'bad')
+        self.assertEqual(403, resp.status_code)
+        self.assertFalse(select_for_update.called)
+        self.assertEqual(0, User.objects.filter(ax_contributor=True).count())
+        self.assertEqual(0, session.batches.count())
+
+        resp = self.post(reverse('sync-ax-session-commit', kwargs={'session_uid': session.uid}), {'secret': 'bad'})
+        self.assertEqual(403, resp.status_code)
+
+        resp = self.post(
+            reverse('sync-ax-session-commit', kwargs={'session_uid': '00000000-0000-0000-0000-000000000000'}),
+            {'secret': 'secret'})
+        self.assertEqual(404, resp.status_code)
+
+
+@override_settings(AX_SYNC_SECRET_CRYPT=CRYPT_SECRET, AX_SYNC_ASYNC_JOBS=True)
+class JobTests(TestCase):
+    """Test the synchronisation in background jobs"""
+    def setUp(self):
+        axsync.forget_verified_secret()
+        create_vaneau_users(3)
+
+    def job_status(self, job_uid):
+        resp = Client().post(
+            reverse('sync-ax-job', kwargs={'job_uid': job_uid}),
+            content_type='application/json',
+            data=json.dumps({'secret': 'secret'}),
+        )
+        self.assertEqual(200, resp.status_code)
+        return resp.json()
+
+    def test_job(self):
+        resp = Client().post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data=json.dumps({'secret': 'secret', 'data': [
+                {'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True},
+                {'xorg_id': 'louis.vaneau.1821', 'ax_contributor': True, 'last_updated': '1830-01-23'},
+                {'xorg_id': 'unexisting.user.1942', 'ax_contributor': True},
+            ]}),
+        )
+        self.assertEqual(202, resp.status_code)
+        job_uid = resp.json()['job']
+        self.assertEqual('pending', resp.json()['status'])
+        self.assertEqual(3, resp.json()['entries'])
+        self.assertEqual(0, User.objects.filter(ax_contributor=True).count())
+
+        out = StringIO()
+        call_command('runaxsyncjobs', once=True, stdout=out)
+        self.assertIn("Job %s done: 3/3 entries, 2 updated, 0 unchanged, 1 unknown" % job_uid, out.getvalue())
+        self.assertEqual(2, User.objects.filter(ax_contributor=True).count())
+
+        status = self.job_status(job_uid)
+        self.assertEqual('done', status['status'])
+        self.assertEqual((3, 2, 0, 1), (status['processed'], status['updated'], status['unchanged'], status['unknown']))
+        self.assertIsNone(status['error'])
+        self.assertEqual(0, AxSyncJob.objects.get(uid=job_uid).chunks.count())
+        self.assertEqual(3, AxSyncChange.objects.filter(sync_id=job_uid).count())
+
+    def test_invalid_job(self):
+        """Invalid data is rejected before creating a job"""
+        c = Client()
+        for entry in ({'xorg_id': 42}, {'xorg_id': 'louis.vaneau.1820', 'last_updated': 'not a date'}, 'entry'):
+            resp = c.post(
+                reverse('sync-ax-data'),
+                content_type='text/plain',
+                data=json.dumps({'secret': 'secret', 'data': [{'xorg_id': 'louis.vaneau.1821'}, entry]}),
+            )
+            self.assertEqual(400, resp.status_code)
+        resp = c.post(
+            reverse('sync-ax-data'),
+            content_type='text/plain',
+            data=json.dumps({'secret': 'bad', 'data': [{'xorg_id': 'louis.vaneau.1821'}]}),
+        )
+        self.assertEqual(403, resp.status_code)
+        self.assertEqual(0, AxSyncJob.objects.count())
+
+    def test_concurrent_workers(self):
+        """A chunk claimed by another worker is skipped, without failing the job"""
+        job = axsync.enqueue_job([
+            {'xorg_id': 'louis.vaneau.1820', 'ax_contributor': True},
+            {'xorg_id': 'louis.vaneau.1821', 'ax_contributor': True},
+        ], batch_size=1)
+        other_chunk = job.chunks.order_by('number').last()
+        sync_batch = axsync.sync_batch
+
+        def sync_batch_and_claim(entries, sync_id):
+            # Another worker claims the second chunk meanwhile
+            AxSyncJobChunk.objects.filter(pk=other_chunk.pk).delete()
+            return sync_batch(entries, sync_id)
+
+        with mock.patch('xorgauth.accounts.axsync.sync_batch', side_effect=sync_batch_and_claim) as mock_sync_batch:
+            job = axsync.run_job(job)
+        self.assertEqual(1, mock_sync_batch.call_count)
+        self.assertEqual(AxSyncJob.DONE, job.status)
+        self.assertEqual((1, 1), (job.processed, job.updated))
+
+        # A worker stops running a job which failed in another worker
+        job = axsync.enqueue_job([{'xorg_id': 'louis.vaneau.1822', 'ax_contributor': True}])
+        AxSyncJob.objects.filter(pk=job.pk).update(status=AxSyncJob.FAILED)
+        job = axsync.run_job(job)
+        self.assertEqual(AxSyncJob.FAILED, job.status)
+        self.assertEqual(1, job.chunks.count())
+
+    def test_failed_job(self):
+        """A job stops at the first chunk which fails, the previous chunks staying applied"""
+        job = axsync.enqueue_job([
+            {'xorg_id': 'louis.vaneau.1820', 'af_id': 42},
+            # AlumnForce IDs are unique
+            {'xorg_id': 'louis.vaneau.1821', 'af_id': 42},
+            {'xorg_id': 'louis.vaneau.1822', 'af_id': 43},
+        ], batch_size=1)
+        self.assertEqual(3, job.chunks.count())
+        with self.assertLogs('xorgauth.accounts.axsync', 'ERROR'):
+            jobs = axsync.run_pending_jobs()
+        self.assertEqual([job], jobs)
+        status = self.job_status(job.uid)
+        self.assertEqual('failed', status['status'])
+        self.assertEqual(1, status['processed'])
+        self.assertIn('IntegrityError', status['error'])
+        self.assertEqual(['42'], list(User.objects.filter(alumnforce_id__isnull=False).values_list(
+            'alumnforce_id', flat=True)))
+        self.assertEqual(2, job.chunks.count())
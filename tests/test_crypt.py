@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+
+from xorgauth.utils.sha512_crypt import make_setting, parse_setting, sha512_crypt
+
+
+class Sha512CryptTests(SimpleTestCase):
+    """Test the implementation of SHA-512-based crypt"""
+
+    # Test vectors from https://www.akkadia.org/drepper/SHA-crypt.txt
+    VECTORS = (
+        ('$6$saltstring', 'Hello world!',
+         '$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1'),
+        ('$6$rounds=10000$saltstringsaltstring', 'Hello world!',
+         '$6$rounds=10000$saltstringsaltst$OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sbHbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBm'
+         'SK6H9qs/y3RnOaw5v.'),
+        ('$6$rounds=5000$toolongsaltstring', 'This is just a test',
+         '$6$rounds=5000$toolongsaltstrin$lQ8jolhgVRVhY4b5pZKaysCLi0QBxGoNeKQzQ3glMhwllF7oGDZxUhx1yxdYcz/e1JSb'
+         'q3y6JMxxl8audkUEm0'),
+        ('$6$rounds=1400$anotherlongsaltstring',
+         'a very much longer text to encrypt.  This one even stretches over morethan one line.',
+         '$6$rounds=1400$anotherlongsalts$POfYwTEok97VWcjxIiSOjiykti.o/pQs.wPvMxQ6Fm7I6IoYN3CmLs66x9t0oSwbtEW7'
+         'o7UmJEiDwGqd8p4ur1'),
+        ('$6$rounds=77777$short', 'we have a short salt string but not a short password',
+         '$6$rounds=77777$short$WuQyW2YR.hBNpjjRhpYD/ifIw05xdfeEyQoMxIXbkvr0gge1a1x3yRULJ5CCaUeOxFmtlcGZelFl5C'
+         'xtgfiAc0'),
+        ('$6$rounds=123456$asaltof16chars..', 'a short string',
+         '$6$rounds=123456$asaltof16chars..$BtCwjqMJGx5hrJhZywWvt0RLE8uZ4oPwcelCjmw2kSYu.Ec6ycULevoBK25fs2xXgM'
+         'NrCzIMVcgEJAstJeonj1'),
+        ('$6$rounds=10$roundstoolow', 'the minimum number is still observed',
+         '$6$rounds=1000$roundstoolow$kUMsbe306n21p9R.FRkW3IGn.S9NPN0x50YhH1xhLsPuWGsUSklZt58jaTfF4ZEQpyUNGc0dq'
+         'bpBYYBaHHrsX.'),
+    )
+
+    def test_known_vectors(self):
+        for setting, password, expected in self.VECTORS:
+            self.assertEqual(sha512_crypt(password, setting), expected)
+
+    def test_verify_with_hash(self):
+        """A hash can be used as the setting to verify a password"""
+        for setting, password, expected in self.VECTORS:
+            self.assertEqual(sha512_crypt(password, expected), expected)
+            self.assertNotEqual(sha512_crypt(password + '!', expected), expected)
+
+    def test_ax_sync_secret(self):
+        """Check the hash of the AX sync secret used in the tests, which was generated with crypt(3)"""
+        encoded = (
+            '$6$789UF3OtQuQGbJVZ$gorL2XAIfptBDtPObm.NKpO0FDESesSLZyEYDwjPbfbKbkEzLHh0MQ'
+            'HCjPL8B3PR.TUaH9eh8OCgQtZDkGAyx/'
+        )
+        self.assertEqual(sha512_crypt('secret', encoded), encoded)
+
+    def test_unicode_password(self):
+        encoded = sha512_crypt('Dépuis Vanéau!', make_setting())
+        self.assertEqual(sha512_crypt('Dépuis Vanéau!', encoded), encoded)
+        self.assertNotEqual(sha512_crypt('Depuis Vaneau!', encoded), encoded)
+
+    def test_make_setting(self):
+        self.assertEqual(parse_setting(make_setting())[:2], (5000, False))
+        self.assertEqual(len(parse_setting(make_setting())[2]), 16)
+        self.assertNotEqual(make_setting(), make_setting())
+        self.assertEqual(parse_setting(make_setting(rounds=20000))[:2], (20000, True))
+
+    def test_invalid_setting(self):
+        with self.assertRaises(ValueError):
+            sha512_crypt('secret', '$1$saltstring')
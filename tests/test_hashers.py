@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from xorgauth.accounts.hashers import PBKDF2WrappedSHA1PasswordHasher, ScryptWrappedSHA1PasswordHasher
+from xorgauth.accounts.models import User
+from xorgauth.management.commands.calibratepbkdf2 import update_ini_option
+
+
+class HasherTests(TestCase):
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_configured_iterations(self):
+        encoded = make_password('Depuis Vaneau!')
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(check_password('Depuis Vaneau!', encoded))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_calibratepbkdf2(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inifile = os.path.join(tmpdir, 'local_settings.ini')
+            with open(inifile, 'w') as fd:
+                fd.write('[auth]\n; Comment\nthread_pool_size = 4\n\n[cache]\nbackend = file\n')
+            out = StringIO()
+            call_command('calibratepbkdf2', '--samples=3', '--write=' + inifile, stdout=out)
+            self.assertIn('Current number of iterations: 1000\n', out.getvalue())
+            recommended = int(out.getvalue().split('Recommended number of iterations: ')[1].split('\n')[0])
+            self.assertGreaterEqual(recommended, 1000)
+            with open(inifile, 'r') as fd:
+                self.assertEqual(
+                    '[auth]\n; Comment\nthread_pool_size = 4\npbkdf2_iterations = %d\n\n[cache]\nbackend = file\n' %
+                    recommended,
+                    fd.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_update_ini_option_empty_section(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inifile = os.path.join(tmpdir, 'local_settings.ini')
+            with open(inifile, 'w') as fd:
+                fd.write('[auth]\n\n[cache]\nbackend = file\n')
+            update_ini_option(inifile, 'auth', 'pbkdf2_iterations', 1000)
+            with open(inifile, 'r') as fd:
+                self.assertEqual('[auth]\npbkdf2_iterations = 1000\n\n[cache]\nbackend = file\n', fd.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @override_settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+    def test_scrypt_wrapped_sha1(self):
+        hasher = ScryptWrappedSHA1PasswordHasher()
+        encoded = hasher.encode('Depuis Vaneau!', 'salt')
+        self.assertTrue(encoded.startswith('scrypt_wrapped_sha1$1024$salt$8$1$'))
+        self.assertTrue(check_password('Depuis Vaneau!', encoded))
+        self.assertFalse(check_password('Wrong password', encoded))
+        self.assertEqual(encoded, hasher.encode_sha1_hash(hashlib.sha1(b'Depuis Vaneau!').hexdigest(), 'salt'))
+        self.assertFalse(hasher.must_update(encoded))
+        with self.settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 11):
+            self.assertTrue(hasher.must_update(encoded))
+            self.assertTrue(check_password('Depuis Vaneau!', encoded))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000, PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+    def test_rewrapsha1passwords(self):
+        sha1_hash = hashlib.sha1(b'Depuis Vaneau!').hexdigest()
+        pbkdf2_hasher = PBKDF2WrappedSHA1PasswordHasher()
+        users = {}
+        for hrid in ('louis.vaneau.1829', 'louis.vaneau.1830', 'louis.vaneau.1831', 'louis.vaneau.1832'):
+            users[hrid] = User.objects.create_user(
+                hrid=hrid,
+                main_email=hrid + '@polytechnique.org',
+                password=None,
+            )
+            users[hrid].password = pbkdf2_hasher.encode_sha1_hash(sha1_hash)
+            users[hrid].save()
+        users['louis.vaneau.1829'].set_password('Changed password')
+        users['louis.vaneau.1829'].save()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            jsonfile = os.path.join(tmpdir, 'accounts.json')
+            with open(jsonfile, 'w') as fd:
+                json.dump({'accounts': [
+                    {'hruid': 'louis.vaneau.1829', 'password': sha1_hash},
+                    {'hruid': 'louis.vaneau.1830', 'password': sha1_hash},
+                    {'hruid': 'louis.vaneau.1831', 'password': hashlib.sha1(b'Other').hexdigest()},
+                    {'hruid': 'louis.vaneau.1832', 'password': sha1_hash},
+                ]}, fd)
+            call_command('rewrapsha1passwords', jsonfile, '--limit=1', stdout=StringIO())
+            self.assertEqual(1, User.objects.filter(password__startswith='scrypt_wrapped_sha1$').count())
+            out = StringIO()
+            call_command('rewrapsha1passwords', jsonfile, stdout=out)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual('1 converted, 1 not matching, 0 missing from the JSON file\n', out.getvalue())
+
+        for user in users.values():
+            user.refresh_from_db()
+        self.assertTrue(users['louis.vaneau.1829'].password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(users['louis.vaneau.1830'].password.startswith('scrypt_wrapped_sha1$'))
+        self.assertTrue(users['louis.vaneau.1830'].check_password('Depuis Vaneau!'))
+        self.assertTrue(users['louis.vaneau.1831'].password.startswith('pbkdf2_wrapped_sha1$'))
+        self.assertTrue(users['louis.vaneau.1832'].password.startswith('scrypt_wrapped_sha1$'))
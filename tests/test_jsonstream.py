@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import json
+
+from django.test import SimpleTestCase
+
+from xorgauth.utils.jsonstream import JSONStreamError, JSONStreamReader
+
+
+class JSONStreamReaderTests(SimpleTestCase):
+    """Test the incremental JSON parser"""
+
+    DOCUMENT = {
+        'secret': 'sécret',
+        'numbers': [1, 12345678901234567890, -3.5e10, 0],
+        'data': [{'id': i, 'name': 'user %d' % i, 'flags': [True, False, None]} for i in range(50)],
+        'empty': [],
+        'nested': {},
+    }
+
+    def make_reader(self, text, chunk_size):
+        return JSONStreamReader(io.BytesIO(text.encode('utf-8')), chunk_size=chunk_size)
+
+    def read_document(self, reader):
+        """Rebuild a document with an object of arrays and values"""
+        result = {}
+        for key in reader.iter_object():
+            if reader.peek() == '[':
+                result[key] = list(reader.iter_array())
+            else:
+                result[key] = reader.read_value()
+        reader.check_end()
+        return result
+
+    def test_chunk_sizes(self):
+        """The result does not depend on where the chunks are cut"""
+        text = json.dumps(self.DOCUMENT, indent=2)
+        for chunk_size in (1, 2, 3, 7, 64, 100000):
+            self.assertEqual(self.read_document(self.make_reader(text, chunk_size)), self.DOCUMENT)
+
+    def test_compact(self):
+        text = json.dumps(self.DOCUMENT, separators=(',', ':'))
+        self.assertEqual(self.read_document(self.make_reader(text, 5)), self.DOCUMENT)
+
+    def test_iterate_lazily(self):
+        """The items of an array are parsed when they are needed"""
+        reader = self.make_reader('{"data": [1, 2, "three", oops]}', 4)
+        keys = reader.iter_object()
+        self.assertEqual(next(keys), 'data')
+        items = reader.iter_array()
+        self.assertEqual([next(items), next(items), next(items)], [1, 2, 'three'])
+        with self.assertRaises(JSONStreamError):
+            next(items)
+
+    def test_invalid_documents(self):
+        for text in ('', '{', '{"bad":"json"', '{"a" 1}', '{"a": [1 2]}', '{1: 2}', '{"a": 1} 2', '[1]'):
+            with self.assertRaises(JSONStreamError):
+                self.read_document(self.make_reader(text, 3))
+
+    def test_max_size(self):
+        """The size of the document and of decoded values can be limited"""
+        text = json.dumps(self.DOCUMENT)
+        reader = JSONStreamReader(io.BytesIO(text.encode('utf-8')), chunk_size=64, max_size=len(text) - 1)
+        with self.assertRaises(JSONStreamError):
+            self.read_document(reader)
+
+        for chunk_size in (1, 7, 100000):
+            reader = self.make_reader('{"a": "%s", "b": "%s"}' % ('x' * 10, 'x' * 11), chunk_size)
+            keys = reader.iter_object()
+            next(keys)
+            self.assertEqual('x' * 10, reader.read_value(max_size=12))
+            next(keys)
+            with self.assertRaises(JSONStreamError):
+                reader.read_value(max_size=12)
+
+    def test_invalid_encoding(self):
+        reader = JSONStreamReader(io.BytesIO(b'{"a": "\xff"}'), chunk_size=3)
+        with self.assertRaises(JSONStreamError):
+            self.read_document(reader)
@@ -31,6 +31,12 @@ class ViewTests(TestCase):
         'auth-groupex-logout',
         'password_reset_confirm',
         'sync-ax-data',
+        'sync-ax-job',
+        'sync-ax-session',
+        'sync-ax-session-batch',
+        'sync-ax-session-commit',
+        'sync-ax-session-open',
+        'sync-ax-watermark',
     )
 
     def test_know_all_views(self):
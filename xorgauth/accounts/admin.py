@@ -56,3 +56,46 @@ class GroupMembershipAdmin(admin.ModelAdmin):
 
     list_display = ['pk', 'group', 'user', 'perms']
     list_filter = ['perms']
+
+
+class AxSyncBatchInline(admin.TabularInline):
+    model = models.AxSyncBatch
+    readonly_fields = ['number', 'received', 'updated', 'unchanged', 'unknown']
+    extra = 0
+
+
+@admin.register(models.AxSyncSession)
+class AxSyncSessionAdmin(admin.ModelAdmin):
+    inlines = [
+        AxSyncBatchInline,
+    ]
+
+    list_display = ['uid', 'created', 'committed']
+    readonly_fields = ['uid', 'created', 'committed']
+
+
+@admin.register(models.AxSyncChange)
+class AxSyncChangeAdmin(admin.ModelAdmin):
+    search_fields = ['sync_id'] + ['user__%s' % f for f in UserAdmin.search_fields]
+
+    list_display = ['date', 'user', 'field', 'old_value', 'new_value']
+    list_filter = ['field', 'date']
+    list_select_related = ['user']
+    readonly_fields = ['sync_id', 'date', 'user', 'field', 'old_value', 'new_value']
+
+    # The changes are an audit trail of the sync, which is pruned by pruneaxsynclog
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.AxSyncJob)
+class AxSyncJobAdmin(admin.ModelAdmin):
+    list_display = ['uid', 'created', 'status', 'entries', 'processed']
+    list_filter = ['status']
+    readonly_fields = [
+        'uid', 'created', 'started', 'finished', 'status', 'error',
+        'entries', 'processed', 'updated', 'unchanged', 'unknown',
+    ]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'xorgauth.accounts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
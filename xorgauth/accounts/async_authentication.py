@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Authentication from asyncio event loops, for ASGI deployments
+
+Database queries and password verifications are blocking, so they are run in
+a pool of threads (or in the bounded pool of xorgauth.accounts.passwords when
+it is enabled), which lets the event loop serve other requests while
+expensive logins are in flight. This module requires Python >= 3.5.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import _clean_credentials, _get_backends, user_login_failed
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+
+from . import passwords, throttling
+from .authentication import XorgBackend
+from .models import User
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AUTH_THREAD_POOL_SIZE)
+        return _executor
+
+
+def _call_with_db(func, *args, **kwargs):
+    """Call a function which may use the database from a thread of the pool"""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run a blocking function in the thread pool and wait for its result"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(_call_with_db, func, *args, **kwargs))
+
+
+def _log_upgrade_failure(user, future):
+    """Log the exception of a password upgrade which has been run in the background"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Unable to upgrade the password hash of %s", user, exc_info=future.exception())
+
+
+async def aget_for_login(username, need_is_active):
+    """Asynchronous variant of UserManager.get_for_login"""
+    return await run_in_thread(User.objects.get_for_login, username, need_is_active)
+
+
+class AsyncXorgBackend(XorgBackend):
+    """Authentication backend which can also be used from an event loop
+
+    authenticate() stays available for synchronous callers.
+    """
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return
+        login_key = User.objects.normalize_login(username)
+        # the throttling counters are in a cache which may be remote
+        await run_in_thread(throttling.check_attempt, request, login_key)
+
+        user = await aget_for_login(username, True)
+        if user is None:
+            await run_in_thread(throttling.record_failure, request, login_key)
+            # do not let attackers find out which usernames exist
+            # (the delay is calibrated by hashing passwords on first use)
+            delay = await run_in_thread(passwords.get_equalization_delay)
+            if delay:
+                await asyncio.sleep(delay)
+            return
+
+        # we now have a candidate user
+        is_correct, must_update = await run_in_thread(passwords.verify_with_limit, password, user.password)
+        if is_correct and must_update:
+            # upgrade the hash without delaying the response
+            loop = asyncio.get_event_loop()
+            upgrade = loop.run_in_executor(
+                _get_executor(), functools.partial(_call_with_db, passwords.upgrade_password, user, password, request))
+            upgrade.add_done_callback(functools.partial(_log_upgrade_failure, user))
+        if is_correct and self.user_can_authenticate(user):
+            return user
+        await run_in_thread(throttling.record_failure, request, login_key)
+
+
+async def aauthenticate(request=None, **credentials):
+    """Asynchronous variant of django.contrib.auth.authenticate
+
+    Backends which do not implement aauthenticate() are run in the thread pool.
+    """
+    for backend, backend_path in _get_backends(return_tuples=True):
+        try:
+            inspect.getcallargs(backend.authenticate, request, **credentials)
+        except TypeError:
+            # This backend doesn't accept these credentials as arguments. Try the next one.
+            continue
+        try:
+            if hasattr(backend, 'aauthenticate'):
+                user = await backend.aauthenticate(request, **credentials)
+            else:
+                user = await run_in_thread(backend.authenticate, request, **credentials)
+        except PermissionDenied:
+            # This backend says to stop in our tracks - this user should not be allowed in at all.
+            break
+        if user is None:
+            continue
+        # Annotate the user object with the path of the backend.
+        user.backend = backend_path
+        return user
+
+    # The credentials supplied are invalid to all backends, fire signal
+    user_login_failed.send(sender=__name__, credentials=_clean_credentials(credentials), request=request)
@@ -1,5 +1,6 @@
 from django.contrib.auth.backends import ModelBackend
 
+from xorgauth.accounts import passwords, throttling
 from xorgauth.accounts.models import User
 
 
@@ -10,10 +11,19 @@ class XorgBackend(ModelBackend):
     just overriding the user search given an hrid or email
     """
     def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return
+        login_key = User.objects.normalize_login(username)
+        throttling.check_attempt(request, login_key)
+
         user = User.objects.get_for_login(username, True)
         if user is None:
+            throttling.record_failure(request, login_key)
+            # do not let attackers find out which usernames exist
+            passwords.equalize_timing()
             return
 
         # we now have a candidate user
-        if user.check_password(password) and self.user_can_authenticate(user):
+        if passwords.check_password(user, password, request) and self.user_can_authenticate(user):
             return user
+        throttling.record_failure(request, login_key)
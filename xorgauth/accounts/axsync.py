@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Synchronisation of account data from the AX website (xorgdata)
+
+The data provider authenticates each request with a secret, which is checked
+against settings.AX_SYNC_SECRET_CRYPT. Computing a SHA-512 crypt hash is
+expensive, so once the secret has been verified, an HMAC of it is remembered
+in the memory of the process for ax_sync.secret_cache_timeout seconds:
+further requests with the same secret only compute this HMAC.
+
+The accounts are updated by batches of SYNC_BATCH_SIZE entries: the users of
+a batch are fetched with a single query, compared in memory with the data,
+and only the fields which changed are written, with bulk_update. The
+request is parsed while it is read, so that only a batch of entries is held
+in memory at a time.
+
+Instead of sending everything in a single request, the data provider can also
+open a session (AxSyncSession), send numbered batches of entries, and commit
+the session. Each batch is applied when it is received and its statistics are
+recorded (AxSyncBatch), so a batch which failed can be sent again without
+sending the whole data again.
+
+The date of the last update of each account in AX is stored in
+User.ax_last_synced. The data provider can query the most recent one (the
+watermark) to only send the accounts which were updated since, and entries
+which are older than the stored date are skipped. As these dates are days,
+the entries of the same day as the stored date are applied again, so that a
+second update made in AX on the same day is not lost.
+
+Every change of a field is recorded in AxSyncChange, with bulk inserts in the
+transaction which applies it. The records which are older than
+ax_sync.log_retention_days days are deleted by the pruneaxsynclog command.
+
+When ax_sync.async_jobs is enabled, the entries of a request are only
+validated and stored in chunks (AxSyncJob and AxSyncJobChunk), and the
+runaxsyncjobs command applies them in the background. This way, the web
+workers stay available for authentication requests during a sync.
+"""
+import collections
+import datetime
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.db.models.query import QuerySet
+from django.utils import six, timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+
+from xorgauth.utils.jsonstream import READ_CHUNK_SIZE, JSONStreamReader
+from xorgauth.utils.sha512_crypt import sha512_crypt
+
+from .models import AxSyncBatch, AxSyncChange, AxSyncJob, AxSyncJobChunk, AxSyncSession, User
+
+
+logger = logging.getLogger(__name__)
+
+# Mapping from User model to value in JSON request
+FIELD_MAPPING = (
+    ('alumnforce_id', 'af_id'),
+    ('ax_contributor', 'ax_contributor'),
+    ('axjr_subscriber', 'axjr_subscribed'),
+    ('ax_last_synced', 'last_updated'),
+)
+
+SYNC_BATCH_SIZE = 500
+
+CHANGE_LOG_FIELDS = {name: code for code, name in AxSyncChange.FIELDS}
+
+
+# (HMAC of the verified secret, configured crypt hash, expiration time)
+_verified_secret = None
+
+
+def _secret_hmac(secret):
+    return hmac.new(force_bytes(settings.SECRET_KEY), force_bytes(secret), hashlib.sha256).hexdigest()
+
+
+def check_secret(secret):
+    """Check the secret given by the data provider against settings.AX_SYNC_SECRET_CRYPT"""
+    global _verified_secret
+    secret_crypt = settings.AX_SYNC_SECRET_CRYPT
+    if not secret_crypt:
+        return False
+    secret_hmac = _secret_hmac(secret)
+
+    verified = _verified_secret
+    if verified is not None:
+        verified_hmac, verified_crypt, expires = verified
+        if (
+            verified_crypt == secret_crypt
+            and time.time() < expires
+            and constant_time_compare(secret_hmac, verified_hmac)
+        ):
+            return True
+
+    try:
+        digest = sha512_crypt(secret, secret_crypt)
+    except ValueError:
+        # The configured secret is not a SHA-512 crypt hash
+        return False
+    if not constant_time_compare(digest, secret_crypt):
+        return False
+    timeout = settings.AX_SYNC_SECRET_CACHE_TIMEOUT
+    if timeout:
+        _verified_secret = (secret_hmac, secret_crypt, time.time() + timeout)
+    return True
+
+
+def forget_verified_secret():
+    """Forget the secret which has been verified, for example when it is changed"""
+    global _verified_secret
+    _verified_secret = None
+
+
+def _bulk_update(users, fields):
+    """Save the given fields of some users, with a single query when possible"""
+    if hasattr(QuerySet, 'bulk_update'):
+        User.objects.bulk_update(users, fields)
+    else:
+        # QuerySet.bulk_update() was introduced in Django 2.2
+        for user in users:
+            user.save(update_fields=fields)
+
+
+def encode_value(value):
+    """Encode the value of a synced field in a short string for AxSyncChange"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+def sync_batch(entries, sync_id):
+    """Update the accounts described by some entries of the data sent by AX
+
+    Each entry is a dict with an "xorg_id" key and the keys of FIELD_MAPPING
+    which need to be synced. This function needs to be called in a
+    transaction, as it reads users before updating them. The changes are
+    recorded with the given synchronisation ID.
+
+    Returns a Counter of the "updated", "unchanged" and "unknown" entries.
+    Raises KeyError, TypeError, ValueError or ValidationError on invalid data.
+    """
+    stats = collections.Counter(updated=0, unchanged=0, unknown=0)
+    hrids = set(entry['xorg_id'] for entry in entries)
+    users = {user.hrid: user for user in User.objects.filter(hrid__in=hrids)}
+
+    changed_users = {}
+    changed_fields = set()
+    changes = []
+    for entry in entries:
+        user = users.get(entry['xorg_id'])
+        if user is None:
+            # Silently skip users that do not exist
+            # If they are created, they will be synced the next time a
+            # synchronisation request is sent to xorgauth.
+            stats['unknown'] += 1
+            continue
+
+        # Skip the entries which are older than the last sync (the dates are
+        # days, so several updates may have been made on the last synced day)
+        last_updated = entry.get('last_updated')
+        if last_updated is not None and user.ax_last_synced is not None:
+            if User._meta.get_field('ax_last_synced').to_python(last_updated) < user.ax_last_synced:
+                stats['unchanged'] += 1
+                continue
+
+        changed = False
+        for model_field, json_field in FIELD_MAPPING:
+            if json_field not in entry:
+                continue
+            new_value = User._meta.get_field(model_field).to_python(entry[json_field])
+            old_value = getattr(user, model_field)
+            if old_value != new_value:
+                changes.append(AxSyncChange(
+                    sync_id=sync_id,
+                    user=user,
+                    field=CHANGE_LOG_FIELDS[model_field],
+                    old_value=encode_value(old_value),
+                    new_value=encode_value(new_value),
+                ))
+                setattr(user, model_field, new_value)
+                changed_users[user.pk] = user
+                changed_fields.add(model_field)
+                changed = True
+        stats['updated' if changed else 'unchanged'] += 1
+
+    # Only write the fields which changed for at least one user of the batch
+    if changed_users:
+        _bulk_update(list(changed_users.values()), sorted(changed_fields))
+        AxSyncChange.objects.bulk_create(changes)
+    return stats
+
+
+def sync_accounts(entries, batch_size=SYNC_BATCH_SIZE, sync_id=None):
+    """Update the accounts described by an iterable of entries, by batches
+
+    The changes are recorded with the given synchronisation ID, or with a new
+    one. Returns a Counter of the "updated", "unchanged" and "unknown" entries.
+    """
+    if sync_id is None:
+        sync_id = uuid.uuid4()
+    stats = collections.Counter(updated=0, unchanged=0, unknown=0)
+    entries = iter(entries)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            return stats
+        stats.update(sync_batch(batch, sync_id))
+
+
+def read_stream(stream, handle_entries, chunk_size=READ_CHUNK_SIZE):
+    """Authenticate a request read from a stream and handle its entries
+
+    The request is a JSON object with the secret of the data provider in
+    "secret" and a list of entries in "data". When the secret comes first (as
+    sent by xorgdata), handle_entries is called with an iterator which parses
+    the entries while they are read. Otherwise they need to be kept in memory
+    until the secret is checked, so they are limited to the size of the
+    requests which Django loads in memory (DATA_UPLOAD_MAX_MEMORY_SIZE).
+
+    Returns the result of handle_entries, or None if the secret is wrong.
+    Raises JSONStreamError if the request is not valid JSON, or is too large.
+    """
+    reader = JSONStreamReader(stream, chunk_size=chunk_size, max_size=settings.AX_SYNC_MAX_REQUEST_SIZE or None)
+    authenticated = False
+    pending_data = None
+    has_data = False
+    result = None
+    for key in reader.iter_object():
+        if key == 'secret':
+            if not check_secret(reader.read_value()):
+                return None
+            authenticated = True
+            if pending_data is not None:
+                result = handle_entries(pending_data)
+                pending_data = None
+        elif key == 'data':
+            has_data = True
+            if not authenticated:
+                pending_data = reader.read_value(max_size=settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+            elif reader.peek() == '[':
+                result = handle_entries(reader.iter_array())
+            else:
+                result = handle_entries(reader.read_value())
+        else:
+            reader.read_value()
+    reader.check_end()
+    if not authenticated:
+        return None
+    if not has_data:
+        raise KeyError('data')
+    return result
+
+
+def sync_stream(stream, batch_size=SYNC_BATCH_SIZE, chunk_size=READ_CHUNK_SIZE, sync_id=None):
+    """Authenticate and apply a synchronisation request read from a stream
+
+    Returns the stats of sync_accounts(), or None if the secret is wrong.
+    Raises the exceptions of read_stream(), and the ones of sync_batch() on
+    invalid data.
+    """
+    if sync_id is None:
+        sync_id = uuid.uuid4()
+    return read_stream(stream, lambda entries: sync_accounts(entries, batch_size, sync_id), chunk_size)
+
+
+def get_watermark():
+    """Get the day of the most recent update which has been synced, and the number of synced accounts"""
+    result = User.objects.filter(ax_last_synced__isnull=False).aggregate(
+        last_synced=Max('ax_last_synced'),
+        synced_accounts=Count('pk'),
+    )
+    return {
+        'last_synced': result['last_synced'].isoformat() if result['last_synced'] else None,
+        'synced_accounts': result['synced_accounts'],
+    }
+
+
+def validate_entry(entry):
+    """Check an entry of the data sent by AX without using the database
+
+    Raises KeyError, TypeError or ValidationError, like sync_batch().
+    """
+    if not isinstance(entry['xorg_id'], six.string_types):
+        raise TypeError("xorg_id needs to be a string")
+    for model_field, json_field in FIELD_MAPPING:
+        if json_field in entry:
+            User._meta.get_field(model_field).to_python(entry[json_field])
+
+
+def enqueue_job(entries, batch_size=SYNC_BATCH_SIZE):
+    """Validate some entries and store them in a new job, by chunks of batch_size entries
+
+    This function needs to be called in a transaction. Returns the job.
+    """
+    job = AxSyncJob.objects.create()
+    entries = iter(entries)
+    for number in itertools.count(1):
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            break
+        for entry in batch:
+            validate_entry(entry)
+        AxSyncJobChunk.objects.create(job=job, number=number, data=json.dumps(batch))
+        job.entries += len(batch)
+    job.save(update_fields=['entries'])
+    return job
+
+
+def enqueue_stream(stream, batch_size=SYNC_BATCH_SIZE, chunk_size=READ_CHUNK_SIZE):
+    """Authenticate a synchronisation request read from a stream and store it in a job
+
+    Returns the job, or None if the secret is wrong. Raises the exceptions of
+    read_stream() and of validate_entry().
+    """
+    return read_stream(stream, lambda entries: enqueue_job(entries, batch_size), chunk_size)
+
+
+def _apply_chunk(job, chunk_pk):
+    """Apply a chunk of a job in the current transaction, unless another worker claimed it"""
+    chunk = AxSyncJobChunk.objects.filter(pk=chunk_pk).first()
+    # Deleting the chunk claims it: a concurrent worker which deletes it too
+    # waits for this transaction, and then deletes nothing
+    if chunk is None or not AxSyncJobChunk.objects.filter(pk=chunk_pk).delete()[0]:
+        return
+    entries = json.loads(chunk.data)
+    stats = sync_batch(entries, job.uid)
+    AxSyncJob.objects.filter(pk=job.pk).update(
+        processed=F('processed') + len(entries),
+        updated=F('updated') + stats['updated'],
+        unchanged=F('unchanged') + stats['unchanged'],
+        unknown=F('unknown') + stats['unknown'],
+    )
+
+
+def run_job(job):
+    """Apply the remaining chunks of a job, each in its own transaction
+
+    Each chunk is deleted in the transaction which applies it and updates the
+    statistics of the job, so an interrupted job can be resumed, and several
+    workers can run the same job without applying a chunk twice.
+    """
+    AxSyncJob.objects.filter(pk=job.pk, started__isnull=True).update(started=timezone.now())
+    AxSyncJob.objects.filter(pk=job.pk, status=AxSyncJob.PENDING).update(status=AxSyncJob.RUNNING)
+
+    for chunk_pk in job.chunks.order_by('number').values_list('pk', flat=True):
+        # Stop when the job failed in another worker
+        if not AxSyncJob.objects.filter(pk=job.pk, status=AxSyncJob.RUNNING).exists():
+            break
+        try:
+            with transaction.atomic():
+                _apply_chunk(job, chunk_pk)
+        except Exception as exc:
+            logger.exception("AX sync job %s failed", job.uid)
+            AxSyncJob.objects.filter(pk=job.pk).update(
+                status=AxSyncJob.FAILED,
+                error='%s: %s' % (type(exc).__name__, exc),
+                finished=timezone.now(),
+            )
+            break
+    else:
+        # The job is done once the chunks being applied by other workers are committed
+        if not job.chunks.exists():
+            AxSyncJob.objects.filter(pk=job.pk, status=AxSyncJob.RUNNING).update(
+                status=AxSyncJob.DONE,
+                finished=timezone.now(),
+            )
+    job.refresh_from_db()
+    return job
+
+
+def run_pending_jobs():
+    """Run the pending jobs, and the running ones which were interrupted, in order
+
+    Several workers can run at the same time, each chunk of a job being
+    applied by a single one. Returns the jobs.
+    """
+    jobs = []
+    while True:
+        job = AxSyncJob.objects.filter(
+            status__in=(AxSyncJob.PENDING, AxSyncJob.RUNNING),
+        ).exclude(pk__in=[job.pk for job in jobs]).order_by('created', 'pk').first()
+        if job is None:
+            return jobs
+        jobs.append(run_job(job))
+
+
+def describe_job(job):
+    """Describe the progress of a job, as a dict for a JSON response"""
+    return {
+        'job': str(job.uid),
+        'status': job.status,
+        'created': job.created.isoformat(),
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+        'entries': job.entries,
+        'processed': job.processed,
+        'updated': job.updated,
+        'unchanged': job.unchanged,
+        'unknown': job.unknown,
+        'error': job.error or None,
+    }
+
+
+class SessionCommitted(Exception):
+    """The synchronisation session has already been committed"""
+
+
+class MissingBatches(Exception):
+    """Some batches of the synchronisation session have not been received"""
+    def __init__(self, numbers):
+        super(MissingBatches, self).__init__("Missing batches: %s" % ', '.join(str(n) for n in numbers))
+        self.numbers = numbers
+
+
+def sync_session_batch(session_uid, number, stream):
+    """Authenticate and apply a batch of a synchronisation session, read from a stream
+
+    When a batch with the same number has already been received, its data is
+    applied again but the statistics which were recorded are kept.
+
+    Returns the AxSyncBatch, or None if the secret is wrong. Raises
+    AxSyncSession.DoesNotExist, SessionCommitted and the exceptions of
+    sync_stream().
+    """
+    def handle_entries(entries):
+        # The secret has been checked: lock the session, so that it is not
+        # committed while the batch is applied
+        session = AxSyncSession.objects.select_for_update().get(uid=session_uid)
+        if session.committed is not None:
+            raise SessionCommitted()
+        stats = sync_accounts(entries, sync_id=session.uid)
+        batch, created = AxSyncBatch.objects.get_or_create(session=session, number=number, defaults=stats)
+        return batch
+
+    with transaction.atomic():
+        return read_stream(stream, handle_entries)
+
+
+def commit_session(session_uid, expected_batches=None):
+    """Mark a synchronisation session as complete
+
+    If expected_batches is given, the batches from 1 to this number need to
+    have been received. Returns the session.
+    """
+    with transaction.atomic():
+        session = AxSyncSession.objects.select_for_update().get(uid=session_uid)
+        if expected_batches is not None:
+            received = set(session.batches.values_list('number', flat=True))
+            missing = [number for number in range(1, expected_batches + 1) if number not in received]
+            if missing:
+                raise MissingBatches(missing)
+        if session.committed is None:
+            session.committed = timezone.now()
+            session.save(update_fields=['committed'])
+        return session
+
+
+def batch_stats(batch):
+    return collections.Counter(updated=batch.updated, unchanged=batch.unchanged, unknown=batch.unknown)
+
+
+def describe_session(session):
+    """Describe a synchronisation session and the statistics of its batches, as a dict for a JSON response"""
+    batches = list(session.batches.all())
+    total = collections.Counter(updated=0, unchanged=0, unknown=0)
+    for batch in batches:
+        total.update(batch_stats(batch))
+    return {
+        'session': str(session.uid),
+        'created': session.created.isoformat(),
+        'committed': session.committed.isoformat() if session.committed else None,
+        'batches': [dict(batch_stats(batch), number=batch.number) for batch in batches],
+        'total': dict(total),
+    }
+
+
+def prune_log(retention_days):
+    """Delete the change records, the sessions and the finished jobs which are older than the given number of days
+
+    Returns the numbers of deleted change records, sessions and jobs.
+    """
+    limit = timezone.now() - datetime.timedelta(days=retention_days)
+    deleted_changes = AxSyncChange.objects.filter(date__lt=limit).delete()[1]
+    deleted_sessions = AxSyncSession.objects.filter(created__lt=limit).delete()[1]
+    deleted_jobs = AxSyncJob.objects.filter(finished__lt=limit).delete()[1]
+    return (
+        deleted_changes.get(AxSyncChange._meta.label, 0),
+        deleted_sessions.get(AxSyncSession._meta.label, 0),
+        deleted_jobs.get(AxSyncJob._meta.label, 0),
+    )
+
+
+def format_stats(stats):
+    """Describe the result of a synchronisation, for the data provider"""
+    return "%(updated)d updated, %(unchanged)d unchanged, %(unknown)d unknown" % stats
@@ -1,9 +1,25 @@
 # Upgrade SHA1 passwords nicely
 # https://docs.djangoproject.com/en/1.11/topics/auth/passwords/#password-upgrading-without-requiring-a-login
+import base64
+import collections
 import hashlib
 
-from django.contrib.auth.hashers import PBKDF2PasswordHasher
-from django.utils.encoding import force_bytes
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes, force_text
+from django.utils.translation import ugettext_noop as _
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2 hasher which uses the number of iterations from the configuration
+
+    The number of iterations can be computed for the local hardware with the
+    calibratepbkdf2 command. Django's default is used if it is not configured.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
 
 
 class PBKDF2WrappedSHA1PasswordHasher(PBKDF2PasswordHasher):
@@ -18,3 +34,76 @@ class PBKDF2WrappedSHA1PasswordHasher(PBKDF2PasswordHasher):
     def encode(self, password, salt, iterations=None):
         sha1_hash = hashlib.sha1(force_bytes(password)).hexdigest()
         return self.encode_sha1_hash(sha1_hash, salt, iterations)
+
+
+class ScryptWrappedSHA1PasswordHasher(hashers.BasePasswordHasher):
+    """Wrap SHA1 hashes in scrypt, a memory-hard key derivation function
+
+    Like PBKDF2WrappedSHA1PasswordHasher, this hasher accepts the SHA1 hashes
+    of the passwords of imported accounts (cf. the rewrapsha1passwords
+    command), but it costs memory instead of only CPU time. The memory and
+    time costs are tuned with auth.scrypt_work_factor (N),
+    auth.scrypt_block_size (r) and auth.scrypt_parallelism (p): computing a
+    hash uses 128 * N * r bytes of memory, p times.
+    """
+    algorithm = 'scrypt_wrapped_sha1'
+    dklen = 64
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+
+    def _scrypt(self, sha1_hash, salt, work_factor, block_size, parallelism):
+        if not hasattr(hashlib, 'scrypt'):
+            raise ValueError("scrypt is not available in hashlib, it requires Python >= 3.6 and OpenSSL >= 1.1")
+        digest = hashlib.scrypt(
+            force_bytes(sha1_hash), salt=force_bytes(salt), n=work_factor, r=block_size, p=parallelism,
+            maxmem=2 * 128 * work_factor * block_size * parallelism, dklen=self.dklen)
+        return force_text(base64.b64encode(digest).strip())
+
+    def encode_sha1_hash(self, sha1_hash, salt=None, work_factor=None, block_size=None, parallelism=None):
+        if salt is None:
+            salt = self.salt()
+        assert salt and '$' not in salt
+        work_factor = work_factor or self.work_factor
+        block_size = block_size or self.block_size
+        parallelism = parallelism or self.parallelism
+        digest = self._scrypt(sha1_hash, salt, work_factor, block_size, parallelism)
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, work_factor, salt, block_size, parallelism, digest)
+
+    def encode(self, password, salt):
+        sha1_hash = hashlib.sha1(force_bytes(password)).hexdigest()
+        return self.encode_sha1_hash(sha1_hash, salt)
+
+    def _decode(self, encoded):
+        algorithm, work_factor, salt, block_size, parallelism, digest = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return int(work_factor), salt, int(block_size), int(parallelism), digest
+
+    def verify(self, password, encoded):
+        work_factor, salt, block_size, parallelism, digest = self._decode(encoded)
+        sha1_hash = hashlib.sha1(force_bytes(password)).hexdigest()
+        return constant_time_compare(digest, self._scrypt(sha1_hash, salt, work_factor, block_size, parallelism))
+
+    def safe_summary(self, encoded):
+        work_factor, salt, block_size, parallelism, digest = self._decode(encoded)
+        return collections.OrderedDict([
+            (_('algorithm'), self.algorithm),
+            (_('work factor'), work_factor),
+            (_('block size'), block_size),
+            (_('parallelism'), parallelism),
+            (_('salt'), hashers.mask_hash(salt)),
+            (_('hash'), hashers.mask_hash(digest)),
+        ])
+
+    def must_update(self, encoded):
+        work_factor, salt, block_size, parallelism, digest = self._decode(encoded)
+        return (work_factor, block_size, parallelism) != (self.work_factor, self.block_size, self.parallelism)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Cache the results of login lookups
+
+Login keys (normalized identifiers given to UserManager.get_for_login) are
+mapped to the primary key of the user they designate, so that the lookup of
+an active account only needs a primary key fetch. Login keys which do not
+designate any account are also remembered for a short time, so that
+brute-force and typo traffic does not query the database again and again.
+
+Every cached entry is tagged with a generation. Replacing the generation
+invalidates all the entries at once, which is done when accounts or aliases
+are created, modified or deleted (through signals) and when accounts are
+imported. Generations are versions from xorgauth.utils.cache_versions, so that
+entries do not become valid again when the generation is evicted from the
+cache.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+from xorgauth.utils import cache_versions
+
+
+GENERATION_KEY = 'xorgauth:login:generation'
+LOGIN_KEY_PREFIX = 'xorgauth:login:key:'
+STATS_KEY_PREFIX = 'xorgauth:login:stats:'
+STATS_NAMES = ('hits', 'unknown_hits', 'misses')
+
+# Value returned by lookup() for login keys which designate nobody
+UNKNOWN = 'unknown'
+
+
+def _get_cache():
+    return caches[settings.LOGIN_CACHE]
+
+
+def _cache_key(login_key):
+    """Hash the login key so that the cache key is valid for every backend"""
+    return LOGIN_KEY_PREFIX + hashlib.sha1(force_bytes(login_key)).hexdigest()
+
+
+def _incr(cache, key):
+    if not settings.LOGIN_CACHE_STATS:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _is_enabled():
+    return bool(settings.LOGIN_CACHE_TIMEOUT or settings.LOGIN_NEGATIVE_CACHE_TIMEOUT)
+
+
+def invalidate():
+    """Forget every cached login lookup"""
+    cache_versions.bump_version(_get_cache(), GENERATION_KEY)
+
+
+def lookup(login_key):
+    """Get the cached result of looking up a login key
+
+    Returns (generation, result), where result is the primary key of the
+    designated user, UNKNOWN if the login key has recently been found to
+    designate nobody, or None if nothing is known. The generation needs to be
+    given to remember_login() or remember_unknown_login(), so that the result
+    of a database query is not cached if the accounts changed in the meantime.
+    """
+    if not _is_enabled():
+        return None, None
+    cache = _get_cache()
+    entry_key = _cache_key(login_key)
+    values = cache.get_many([GENERATION_KEY, entry_key])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        generation = cache_versions.get_version(cache, GENERATION_KEY)
+    entry = values.get(entry_key)
+    if entry is None or entry[0] != generation:
+        _incr(cache, STATS_KEY_PREFIX + 'misses')
+        return generation, None
+    if entry[1] is None:
+        _incr(cache, STATS_KEY_PREFIX + 'unknown_hits')
+        return generation, UNKNOWN
+    _incr(cache, STATS_KEY_PREFIX + 'hits')
+    return generation, entry[1]
+
+
+def remember_login(login_key, user_pk, generation):
+    """Record the primary key of the user designated by the login key, found in the given generation"""
+    if not settings.LOGIN_CACHE_TIMEOUT or generation is None:
+        return
+    _get_cache().set(_cache_key(login_key), (generation, user_pk), settings.LOGIN_CACHE_TIMEOUT)
+
+
+def remember_unknown_login(login_key, generation):
+    """Record that the login key did not designate any account in the given generation"""
+    if not settings.LOGIN_NEGATIVE_CACHE_TIMEOUT or generation is None:
+        return
+    _get_cache().set(_cache_key(login_key), (generation, None), settings.LOGIN_NEGATIVE_CACHE_TIMEOUT)
+
+
+def get_stats():
+    """Get the counters of cache hits and misses since the cache was created
+
+    The counters are only updated when the setting LOGIN_CACHE_STATS is enabled.
+    """
+    values = _get_cache().get_many([STATS_KEY_PREFIX + name for name in STATS_NAMES])
+    return {name: values.get(STATS_KEY_PREFIX + name, 0) for name in STATS_NAMES}
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def forwards_func(apps, schema_editor):
+    UserAlias = apps.get_model('accounts', 'UserAlias')
+    db_alias = schema_editor.connection.alias
+    for alias in UserAlias.objects.using(db_alias).only('email').iterator():
+        alias.local_part = alias.email.split('@', 1)[0]
+        alias.save(update_fields=['local_part'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_add_ax_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useralias',
+            name='local_part',
+            field=models.CharField(db_index=True, default='', editable=False,
+                                   help_text='Part of the email alias before @, used to log in with firstname.lastname',
+                                   max_length=254, verbose_name='local part'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
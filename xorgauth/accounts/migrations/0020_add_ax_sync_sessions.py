@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_add_alias_local_part'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AxSyncSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('committed', models.DateTimeField(blank=True, null=True, verbose_name='commit date')),
+            ],
+            options={
+                'verbose_name': 'AX sync session',
+                'verbose_name_plural': 'AX sync sessions',
+            },
+        ),
+        migrations.CreateModel(
+            name='AxSyncBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='number')),
+                ('received', models.DateTimeField(auto_now_add=True, verbose_name='reception date')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='updated accounts')),
+                ('unchanged', models.PositiveIntegerField(default=0, verbose_name='unchanged accounts')),
+                ('unknown', models.PositiveIntegerField(default=0, verbose_name='unknown accounts')),
+                ('session', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='accounts.AxSyncSession',
+                    verbose_name='session')),
+            ],
+            options={
+                'verbose_name': 'AX sync batch',
+                'verbose_name_plural': 'AX sync batches',
+                'ordering': ['session', 'number'],
+                'unique_together': {('session', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0020_add_ax_sync_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='ax_last_synced',
+            field=models.DateField(blank=True, db_index=True, null=True, verbose_name='last sync with AX'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0021_index_ax_last_synced'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AxSyncChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sync_id', models.UUIDField(
+                    db_index=True,
+                    help_text='UUID of the session, or of the request for synchronisations in a single request',
+                    verbose_name='synchronisation ID')),
+                ('date', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='date')),
+                ('field', models.PositiveSmallIntegerField(
+                    choices=[
+                        (1, 'alumnforce_id'), (2, 'ax_contributor'), (3, 'axjr_subscriber'), (4, 'ax_last_synced'),
+                    ],
+                    verbose_name='field')),
+                ('old_value', models.CharField(blank=True, max_length=20, null=True, verbose_name='old value')),
+                ('new_value', models.CharField(blank=True, max_length=20, null=True, verbose_name='new value')),
+                ('user', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='ax_sync_changes',
+                    to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'AX sync change',
+                'verbose_name_plural': 'AX sync changes',
+            },
+        ),
+    ]
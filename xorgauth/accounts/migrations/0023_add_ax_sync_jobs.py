@@ -0,0 +1,55 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_add_ax_sync_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AxSyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='start date')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='end date')),
+                ('status', models.CharField(
+                    choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')],
+                    db_index=True, default='pending', max_length=10, verbose_name='status')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='entries')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='processed entries')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='updated accounts')),
+                ('unchanged', models.PositiveIntegerField(default=0, verbose_name='unchanged accounts')),
+                ('unknown', models.PositiveIntegerField(default=0, verbose_name='unknown accounts')),
+            ],
+            options={
+                'verbose_name': 'AX sync job',
+                'verbose_name_plural': 'AX sync jobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='AxSyncJobChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='number')),
+                ('data', models.TextField(verbose_name='data')),
+                ('job', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='accounts.AxSyncJob',
+                    verbose_name='job')),
+            ],
+            options={
+                'verbose_name': 'AX sync job chunk',
+                'verbose_name_plural': 'AX sync job chunks',
+                'ordering': ['job', 'number'],
+                'unique_together': {('job', 'number')},
+            },
+        ),
+    ]
@@ -12,9 +12,24 @@ from django.utils.translation import ugettext_lazy as _
 
 from xorgauth.utils.fields import DottedSlugField, UnboundedCharField
 
+from . import login_cache
+
 
 ADMIN_ROLE_HRID = 'admin'
 
+# Kinds of identifiers which can be used to log in
+LOGIN_HRID = 0
+LOGIN_MAIN_EMAIL = 1
+LOGIN_ALIAS = 2
+LOGIN_ALIAS_PREFIX = 3
+
+# Results of UserManager.resolve_logins() for logins which do not designate a single user
+UNKNOWN_LOGIN = 'unknown'
+AMBIGUOUS_LOGIN = 'ambiguous'
+
+# Number of logins which are resolved with each query in UserManager.resolve_logins()
+RESOLVE_LOGINS_BATCH_SIZE = 400
+
 
 class Role(models.Model):
     ALUMNI_ROLES_HRID = (
@@ -59,6 +74,84 @@ class UserManager(base_user.BaseUserManager):
         user.save(using=self._db)
         return user
 
+    @staticmethod
+    def normalize_login(username):
+        """Normalize a login identifier into the key which is used to look it up
+
+        Human-readable identifiers and email addresses are always stored in
+        lowercase (this is enforced by User.clean and UserAlias.clean), so any
+        login attempt can be lowercased once before querying the database.
+        """
+        return username.lower()
+
+    def _login_candidates(self, keys):
+        """Fetch every user which may be designated by one of the given login keys
+
+        All the ways a user can be designated (human-readable ID, main email,
+        email alias, beginning of an email alias) are queried at once with a
+        UNION of indexed lookups. Each returned user is annotated with
+        login_kind (one of the LOGIN_* constants) and login_key (the value of
+        the field which matched).
+        """
+        email_keys = [key for key in keys if "@" in key]
+        name_keys = [key for key in keys if "@" not in key]
+        querysets = []
+        if email_keys:
+            querysets += [
+                self.filter(main_email__in=email_keys).annotate(
+                    login_kind=models.Value(LOGIN_MAIN_EMAIL, models.IntegerField()),
+                    login_key=models.F('main_email')),
+                self.filter(aliases__email__in=email_keys).annotate(
+                    login_kind=models.Value(LOGIN_ALIAS, models.IntegerField()),
+                    login_key=models.F('aliases__email')),
+            ]
+        if name_keys:
+            querysets += [
+                self.filter(hrid__in=name_keys).annotate(
+                    login_kind=models.Value(LOGIN_HRID, models.IntegerField()),
+                    login_key=models.F('hrid')),
+                self.filter(aliases__local_part__in=name_keys).annotate(
+                    login_kind=models.Value(LOGIN_ALIAS_PREFIX, models.IntegerField()),
+                    login_key=models.F('aliases__local_part')).distinct(),
+            ]
+        if not querysets:
+            return []
+        return list(querysets[0].union(*querysets[1:], all=True))
+
+    @staticmethod
+    def _index_login_candidates(candidates):
+        """Group the candidates by the kind and the value of the key which matched"""
+        index = {}
+        for user in candidates:
+            index.setdefault((user.login_kind, user.login_key), []).append(user)
+        return index
+
+    @staticmethod
+    def _pick_login_candidate(index, key):
+        """Find the user designated by the given login key among indexed candidates
+
+        Returns UNKNOWN_LOGIN if no user matches and AMBIGUOUS_LOGIN if several
+        users match.
+        """
+        if "@" in key:
+            kinds = (LOGIN_MAIN_EMAIL, LOGIN_ALIAS)
+        else:
+            kinds = (LOGIN_HRID,)
+        for kind in kinds:
+            users = index.get((kind, key))
+            if users:
+                return users[0]
+        if "@" in key:
+            return UNKNOWN_LOGIN
+
+        # look up in alias emails, which are distinct for each user
+        users = index.get((LOGIN_ALIAS_PREFIX, key))
+        if not users:
+            return UNKNOWN_LOGIN
+        if len(users) > 1:
+            return AMBIGUOUS_LOGIN
+        return users[0]
+
     def get_for_login(self, username, need_is_active):
         """Get a user for the given username, mail email or email alias
 
@@ -67,39 +160,53 @@ class UserManager(base_user.BaseUserManager):
 
         Returns None if no user has been found
         """
-        def lookup(username):
-            if "@" in username:
-                # The username seems to be an email
-                try:
-                    user = self.get(main_email=username)
-                except User.DoesNotExist:
-                    # try aliases
-                    try:
-                        user = UserAlias.objects.get(email=username).user
-                    except UserAlias.DoesNotExist:
-                        return None
-            else:
-                # The username is either a hrid or the beginning of an alias email
-                try:
-                    # try to get user by exact hrid
-                    user = self.get(hrid=username)
-                except User.DoesNotExist:
-                    # look up in alias emails
-                    email_prefix = username + "@"
-                    try:
-                        user = self.filter(aliases__email__startswith=email_prefix).distinct().get()
-                    except User.DoesNotExist:
-                        return None
-                    except User.MultipleObjectsReturned:
-                        # TODO: exploit this exception to display error message in form
-                        return None
-
-            # do not return an inactive user if an active one has been requested
-            if user is not None and need_is_active and not user.is_active:
-                return
-            return user
-        # also accept non lowercase login attempts
-        return lookup(username) or lookup(username.lower())
+        key = self.normalize_login(username)
+        user = None
+        generation, cached = login_cache.lookup(key)
+        if cached == login_cache.UNKNOWN:
+            return None
+        elif cached is not None:
+            user = self.filter(pk=cached).first()
+
+        if user is None:
+            candidates = self._login_candidates([key])
+            if not candidates:
+                login_cache.remember_unknown_login(key, generation)
+                return None
+            user = self._pick_login_candidate(self._index_login_candidates(candidates), key)
+            if user in (UNKNOWN_LOGIN, AMBIGUOUS_LOGIN):
+                # TODO: exploit ambiguous aliases to display error message in form
+                return None
+            login_cache.remember_login(key, user.pk, generation)
+
+        # do not return an inactive user if an active one has been requested
+        if user is not None and need_is_active and not user.is_active:
+            return None
+        return user
+
+    def resolve_logins(self, usernames, need_is_active):
+        """Get the users for many usernames, main emails or email aliases at once
+
+        The usernames are resolved with the same rules as get_for_login(), in a
+        number of queries bounded by the number of usernames divided by
+        RESOLVE_LOGINS_BATCH_SIZE.
+
+        Returns a dict which maps each username either to a user, to
+        UNKNOWN_LOGIN if no (active) user has been found, or to AMBIGUOUS_LOGIN
+        if several users match.
+        """
+        keys_by_username = {username: self.normalize_login(username) for username in usernames}
+        keys = sorted(set(keys_by_username.values()))
+        results = {}
+        for batch_start in range(0, len(keys), RESOLVE_LOGINS_BATCH_SIZE):
+            batch_keys = keys[batch_start:batch_start + RESOLVE_LOGINS_BATCH_SIZE]
+            index = self._index_login_candidates(self._login_candidates(batch_keys))
+            for key in batch_keys:
+                user = self._pick_login_candidate(index, key)
+                if user not in (UNKNOWN_LOGIN, AMBIGUOUS_LOGIN) and need_is_active and not user.is_active:
+                    user = UNKNOWN_LOGIN
+                results[key] = user
+        return {username: results[key] for username, key in keys_by_username.items()}
 
 
 class User(base_user.AbstractBaseUser):
@@ -139,7 +246,7 @@ class User(base_user.AbstractBaseUser):
     death_date = models.DateField(_("death date"), blank=True, null=True)
     ax_contributor = models.NullBooleanField(_('AX contributor'), help_text=_('Paid a contribution to AX'))
     axjr_subscriber = models.NullBooleanField(_('J&R subscriber'), help_text=_('Subscribed to La Jaune et la Rouge'))
-    ax_last_synced = models.DateField(_("last sync with AX"), blank=True, null=True)
+    ax_last_synced = models.DateField(_("last sync with AX"), blank=True, null=True, db_index=True)
 
     objects = UserManager()
 
@@ -213,6 +320,8 @@ class UserAlias(models.Model):
     """Alias login"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='aliases', verbose_name=_("user"))
     email = models.EmailField(_("email alias"), unique=True)
+    local_part = models.CharField(_("local part"), max_length=254, db_index=True, editable=False, help_text=_(
+        "Part of the email alias before @, used to log in with firstname.lastname"))
 
     class Meta:
         verbose_name = _("user alias")
@@ -221,6 +330,14 @@ class UserAlias(models.Model):
     def __str__(self):
         return self.email
 
+    def update_local_part(self):
+        """Synchronize the local part with the email address"""
+        self.local_part = self.email.split('@', 1)[0]
+
+    def save(self, *args, **kwargs):
+        self.update_local_part()
+        super(UserAlias, self).save(*args, **kwargs)
+
     def clean(self):
         # Make sure the email address is in lowercase
         if self.email != self.email.lower():
@@ -265,3 +382,120 @@ class GoogleAppsPassword(models.Model):
     class Meta:
         verbose_name = _("Google Apps password")
         verbose_name_plural = _("Google Apps passwords")
+
+
+class AxSyncSession(models.Model):
+    """Synchronisation of AX data which is sent in several batches"""
+    uid = models.UUIDField("UUID", default=uuid.uuid4, unique=True, editable=False)
+    created = models.DateTimeField(_("creation date"), auto_now_add=True)
+    committed = models.DateTimeField(_("commit date"), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _("AX sync session")
+        verbose_name_plural = _("AX sync sessions")
+
+    def __str__(self):
+        return str(self.uid)
+
+
+class AxSyncBatch(models.Model):
+    """Batch of AX data which has been applied in a synchronisation session"""
+    session = models.ForeignKey(AxSyncSession, on_delete=models.CASCADE, related_name='batches',
+                                verbose_name=_("session"))
+    number = models.PositiveIntegerField(_("number"))
+    received = models.DateTimeField(_("reception date"), auto_now_add=True)
+    updated = models.PositiveIntegerField(_("updated accounts"), default=0)
+    unchanged = models.PositiveIntegerField(_("unchanged accounts"), default=0)
+    unknown = models.PositiveIntegerField(_("unknown accounts"), default=0)
+
+    class Meta:
+        verbose_name = _("AX sync batch")
+        verbose_name_plural = _("AX sync batches")
+        unique_together = ('session', 'number')
+        ordering = ['session', 'number']
+
+    def __str__(self):
+        return '%s #%d' % (self.session, self.number)
+
+
+class AxSyncChange(models.Model):
+    """Change of a field of a user account, made by a synchronisation of AX data
+
+    The changes are only appended, in bulk. In order to keep the table small,
+    fields are stored as small integers and values as short strings (see
+    xorgauth.accounts.axsync.encode_value).
+    """
+    ALUMNFORCE_ID = 1
+    AX_CONTRIBUTOR = 2
+    AXJR_SUBSCRIBER = 3
+    AX_LAST_SYNCED = 4
+    FIELDS = (
+        (ALUMNFORCE_ID, 'alumnforce_id'),
+        (AX_CONTRIBUTOR, 'ax_contributor'),
+        (AXJR_SUBSCRIBER, 'axjr_subscriber'),
+        (AX_LAST_SYNCED, 'ax_last_synced'),
+    )
+
+    sync_id = models.UUIDField(_("synchronisation ID"), db_index=True, help_text=_(
+        "UUID of the session, or of the request for synchronisations in a single request"))
+    date = models.DateTimeField(_("date"), auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ax_sync_changes', verbose_name=_("user"))
+    field = models.PositiveSmallIntegerField(_("field"), choices=FIELDS)
+    old_value = models.CharField(_("old value"), max_length=20, blank=True, null=True)
+    new_value = models.CharField(_("new value"), max_length=20, blank=True, null=True)
+
+    class Meta:
+        verbose_name = _("AX sync change")
+        verbose_name_plural = _("AX sync changes")
+
+    def __str__(self):
+        return '%s: %s %r -> %r' % (self.user_id, self.get_field_display(), self.old_value, self.new_value)
+
+
+class AxSyncJob(models.Model):
+    """Synchronisation of AX data which is processed in the background by the runaxsyncjobs command"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, _("pending")),
+        (RUNNING, _("running")),
+        (DONE, _("done")),
+        (FAILED, _("failed")),
+    )
+
+    uid = models.UUIDField("UUID", default=uuid.uuid4, unique=True, editable=False)
+    created = models.DateTimeField(_("creation date"), auto_now_add=True)
+    started = models.DateTimeField(_("start date"), blank=True, null=True)
+    finished = models.DateTimeField(_("end date"), blank=True, null=True)
+    status = models.CharField(_("status"), max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    error = models.TextField(_("error"), blank=True)
+    entries = models.PositiveIntegerField(_("entries"), default=0)
+    processed = models.PositiveIntegerField(_("processed entries"), default=0)
+    updated = models.PositiveIntegerField(_("updated accounts"), default=0)
+    unchanged = models.PositiveIntegerField(_("unchanged accounts"), default=0)
+    unknown = models.PositiveIntegerField(_("unknown accounts"), default=0)
+
+    class Meta:
+        verbose_name = _("AX sync job")
+        verbose_name_plural = _("AX sync jobs")
+
+    def __str__(self):
+        return str(self.uid)
+
+
+class AxSyncJobChunk(models.Model):
+    """Entries of an AX sync job which have not been processed yet, encoded in JSON"""
+    job = models.ForeignKey(AxSyncJob, on_delete=models.CASCADE, related_name='chunks', verbose_name=_("job"))
+    number = models.PositiveIntegerField(_("number"))
+    data = models.TextField(_("data"))
+
+    class Meta:
+        verbose_name = _("AX sync job chunk")
+        verbose_name_plural = _("AX sync job chunks")
+        unique_together = ('job', 'number')
+        ordering = ['job', 'number']
+
+    def __str__(self):
+        return '%s #%d' % (self.job, self.number)
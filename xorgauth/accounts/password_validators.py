@@ -1,30 +1,28 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) Polytechnique.org
 # This code is distributed under the Affero General Public License version 3
-import crypt
-import sys
-
-from django.core.exceptions import ObjectDoesNotExist
-from django.utils.crypto import get_random_string
+from xorgauth.utils import deferred
+from xorgauth.utils.sha512_crypt import make_setting, sha512_crypt
 
 from . import models
 
 
+def update_gapps_password(user_id, raw_password):
+    """Hash the password in a way compatible with Google Apps: crypt with $6"""
+    password = sha512_crypt(raw_password, make_setting())
+    models.GoogleAppsPassword.objects.update_or_create(user_id=user_id, defaults={'password': password})
+
+
 class GoogleAppsPasswordValidator(object):
-    """Update the Google Apps password when a user changes her password"""
+    """Update the Google Apps password when a user changes her password
+
+    Hashing the password is deferred until the password change has been
+    committed, so that it does not delay the response. The updates of a user
+    run in order, so that an older password never overwrites a newer one.
+    """
 
     def validate(self, password, user=None):
         return
 
     def password_changed(self, raw_password, user):
-        # Hash the password in a way compatible with Google Apps: crypt with $6
-        if sys.version_info >= (3,):
-            password = crypt.crypt(raw_password, salt=crypt.METHOD_SHA512)
-        else:
-            password = crypt.crypt(raw_password.encode('utf-8'), '$6$' + get_random_string(16))
-        try:
-            user.gapps_password.password = password
-        except ObjectDoesNotExist:
-            models.GoogleAppsPassword.objects.create(user=user, password=password)
-        else:
-            user.gapps_password.save()
+        deferred.defer_in_order(('gapps_password', user.pk), update_gapps_password, user.pk, raw_password)
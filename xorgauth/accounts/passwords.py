@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Verify passwords with a limit on the number of concurrent verifications
+
+Password hashers are designed to be slow, so a flood of login attempts can
+keep every worker busy computing hashes. When auth.password_check_limit is
+set, at most this number of verifications are computed at the same time by
+all the processes which share the cache of the logins (so the limit is per
+process with the locmem backend). Further attempts fail immediately with
+PasswordCheckOverloaded, which is turned into a "429 Too Many Requests"
+response by xorgauth.middleware.
+
+The durations of the verifications are also recorded, in order to make login
+attempts with unknown usernames last as long as attempts with known ones
+without computing any hash (when auth.equalize_timing is enabled).
+
+When a hash needs to be upgraded (because it uses an old hasher or an old
+number of iterations), the new hash is computed once the response to the
+login request has been sent.
+"""
+import collections
+import contextlib
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, hashers
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordCheckOverloaded(Exception):
+    """Too many password verifications are already in progress"""
+
+
+# Verifications in progress take "slots" in the cache of the logins, which is
+# shared between processes. A slot expires after this number of seconds, so
+# that the slots of processes which crashed are eventually freed.
+SLOT_TIMEOUT = 30
+SLOT_KEY_PREFIX = 'xorgauth:passwords:slot:'
+
+
+@contextlib.contextmanager
+def verification_slot():
+    """Reserve a slot for a password verification, or raise PasswordCheckOverloaded"""
+    limit = settings.AUTH_PASSWORD_CHECK_LIMIT
+    if not limit:
+        yield
+        return
+    cache = caches[settings.LOGIN_CACHE]
+    # Start from a random slot, so that the free slots are found quickly
+    first = random.randrange(limit)
+    for i in range(limit):
+        key = SLOT_KEY_PREFIX + str((first + i) % limit)
+        if cache.add(key, 1, SLOT_TIMEOUT):
+            break
+    else:
+        raise PasswordCheckOverloaded()
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+# Durations of the recent password verifications, in seconds
+_durations = collections.deque(maxlen=100)
+
+
+def verify(raw_password, encoded):
+    """Verify a password against its hash, without touching the database
+
+    Returns a tuple (is_correct, must_update) where must_update tells whether
+    the hash needs to be upgraded to the preferred hasher.
+    """
+    updates = []
+    start = time.time()
+    is_correct = hashers.check_password(raw_password, encoded, setter=updates.append)
+    _durations.append(time.time() - start)
+    return is_correct, bool(updates)
+
+
+def get_equalization_delay():
+    """Get how long a login attempt for an unknown user needs to wait
+
+    The delay is drawn from the durations of the recent verifications, so
+    that it follows their distribution. Returns 0 if the timing equalization
+    is disabled.
+    """
+    if not settings.AUTH_EQUALIZE_TIMING:
+        return 0
+    if not _durations:
+        # Calibrate with a single verification of a dummy password
+        verify(get_random_string(), hashers.make_password(get_random_string()))
+    return random.choice(list(_durations))
+
+
+def equalize_timing():
+    """Wait as long as a password verification, without computing any hash"""
+    delay = get_equalization_delay()
+    if delay:
+        time.sleep(delay)
+
+
+def verify_with_limit(raw_password, encoded):
+    """Verify a password like verify(), once a slot is available
+
+    Raises PasswordCheckOverloaded if too many verifications are in progress.
+    """
+    with verification_slot():
+        return verify(raw_password, encoded)
+
+
+def upgrade_password(user, raw_password, request=None):
+    """Hash again the password of a user with the preferred hasher
+
+    If the user is logged in the session of the given request, the session is
+    updated so that it stays valid with the new hash.
+    """
+    with transaction.atomic():
+        user.set_password(raw_password)
+        # Password hash upgrades shouldn't be considered password changes.
+        user._password = None
+        user.save(update_fields=['password'])
+
+        session = getattr(request, 'session', None)
+        if (
+            session is not None
+            and HASH_SESSION_KEY in session
+            and session.get(SESSION_KEY) == user._meta.pk.value_to_string(user)
+        ):
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+
+
+# Password upgrades which are waiting for the end of the current request
+_pending = threading.local()
+
+
+def start_deferring_upgrades():
+    """Defer the password upgrades until the response to the request has been sent"""
+    _pending.upgrades = []
+
+
+def run_deferred_upgrades():
+    """Run the password upgrades which have been deferred in the current thread"""
+    upgrades = getattr(_pending, 'upgrades', None)
+    _pending.upgrades = None
+    for user, raw_password, request in upgrades or ():
+        try:
+            upgrade_password(user, raw_password, request)
+        except Exception:
+            logger.exception("Unable to upgrade the password hash of %s", user)
+
+
+def schedule_upgrade(user, raw_password, request=None):
+    """Upgrade the password hash of a user, after the response if a request is being processed
+
+    This way, the login request does not pay for computing the new hash.
+    """
+    upgrades = getattr(_pending, 'upgrades', None)
+    if upgrades is None:
+        upgrade_password(user, raw_password, request)
+    else:
+        upgrades.append((user, raw_password, request))
+
+
+def check_password(user, raw_password, request=None):
+    """Check the password of a user, like AbstractBaseUser.check_password"""
+    is_correct, must_update = verify_with_limit(raw_password, user.password)
+    if is_correct and must_update:
+        schedule_upgrade(user, raw_password, request)
+    return is_correct
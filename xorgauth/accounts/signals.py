@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import login_cache, passwords
+from .models import User, UserAlias
+
+
+# Fields of User which can be used to log in
+LOGIN_FIELDS = frozenset(('hrid', 'main_email'))
+
+
+def _invalidate_login_cache():
+    login_cache.invalidate()
+    # Concurrent lookups may have cached the logins as they were before the
+    # change was committed
+    transaction.on_commit(login_cache.invalidate)
+
+
+@receiver(post_save, sender=User, dispatch_uid='xorgauth_user_login_cache')
+def invalidate_login_cache_for_user(sender, instance, created, update_fields=None, **kwargs):
+    """Logins may designate another account when an account is created or modified"""
+    if created or update_fields is None or LOGIN_FIELDS.intersection(update_fields):
+        _invalidate_login_cache()
+
+
+@receiver(post_save, sender=UserAlias, dispatch_uid='xorgauth_useralias_login_cache')
+@receiver(post_delete, sender=User, dispatch_uid='xorgauth_user_delete_login_cache')
+@receiver(post_delete, sender=UserAlias, dispatch_uid='xorgauth_useralias_delete_login_cache')
+def invalidate_login_cache(sender, instance, **kwargs):
+    _invalidate_login_cache()
+
+
+@receiver(request_started, dispatch_uid='xorgauth_defer_password_upgrades')
+def defer_password_upgrades(sender, **kwargs):
+    passwords.start_deferring_upgrades()
+
+
+@receiver(request_finished, dispatch_uid='xorgauth_run_password_upgrades')
+def run_password_upgrades(sender, **kwargs):
+    """Upgrade password hashes once the response has been sent"""
+    passwords.run_deferred_upgrades()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Throttle failed login attempts
+
+Failed login attempts are counted for each login identifier and for each
+client IP address in a sliding window of auth.throttle_window seconds. When a
+limit is reached, further attempts are rejected with LoginThrottled before
+looking the user up or computing any password hash, and
+xorgauth.middleware turns this exception into a "429 Too Many Requests"
+response.
+
+The sliding window is approximated with two fixed windows: the count of the
+previous window is weighted by how much it overlaps the sliding window. The
+counters are stored in the cache of login lookups, so they are shared between
+processes when this cache is.
+
+Behind reverse proxies, REMOTE_ADDR is the address of the nearest proxy, so
+auth.trusted_proxies needs to be set to the number of proxies which append the
+address of their client to the X-Forwarded-For header. The client IP address
+is then read from this header, ignoring the addresses which the client could
+have forged.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+
+THROTTLE_KEY_PREFIX = 'xorgauth:throttle:'
+
+
+class LoginThrottled(Exception):
+    """Too many login attempts failed recently"""
+    def __init__(self, retry_after):
+        super(LoginThrottled, self).__init__("Too many failed login attempts")
+        self.retry_after = retry_after
+
+
+def _get_cache():
+    return caches[settings.LOGIN_CACHE]
+
+
+def get_client_ip(request):
+    """Get the IP address of the client, or None if it is unknown"""
+    if request is None:
+        return None
+    proxies = settings.TRUSTED_PROXIES
+    if not proxies:
+        return request.META.get('REMOTE_ADDR') or None
+    # Each trusted proxy appended the address of its client to the header
+    addresses = [addr.strip() for addr in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+    if len(addresses) < proxies:
+        return None
+    return addresses[-proxies] or None
+
+
+def _get_scopes(request, login_key):
+    """Get the (name, value, limit) of the scopes in which attempts are counted"""
+    scopes = []
+    if settings.LOGIN_THROTTLE_PER_LOGIN and login_key:
+        scopes.append(('login', login_key, settings.LOGIN_THROTTLE_PER_LOGIN))
+    if settings.LOGIN_THROTTLE_PER_IP:
+        client_ip = get_client_ip(request)
+        if client_ip:
+            scopes.append(('ip', client_ip, settings.LOGIN_THROTTLE_PER_IP))
+    return scopes
+
+
+def _counter_key(scope, value, window_index):
+    return '%s%s:%s:%d' % (THROTTLE_KEY_PREFIX, scope, hashlib.sha1(force_bytes(value)).hexdigest(), window_index)
+
+
+def check_attempt(request, login_key):
+    """Raise LoginThrottled if too many attempts failed recently"""
+    scopes = _get_scopes(request, login_key)
+    if not scopes:
+        return
+    window = settings.LOGIN_THROTTLE_WINDOW
+    now = time.time()
+    window_index = int(now // window)
+    previous_weight = 1. - (now % window) / window
+
+    keys = []
+    for scope, value, limit in scopes:
+        keys += [_counter_key(scope, value, window_index), _counter_key(scope, value, window_index - 1)]
+    counters = _get_cache().get_many(keys)
+    for scope, value, limit in scopes:
+        current = counters.get(_counter_key(scope, value, window_index), 0)
+        previous = counters.get(_counter_key(scope, value, window_index - 1), 0)
+        if current + previous * previous_weight >= limit:
+            raise LoginThrottled(retry_after=int(window - now % window) + 1)
+
+
+def record_failure(request, login_key):
+    """Count a failed login attempt"""
+    scopes = _get_scopes(request, login_key)
+    if not scopes:
+        return
+    cache = _get_cache()
+    window = settings.LOGIN_THROTTLE_WINDOW
+    window_index = int(time.time() // window)
+    for scope, value, limit in scopes:
+        key = _counter_key(scope, value, window_index)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            count = 1
+        # The counter is needed until the end of the next window. Set its
+        # timeout again, as incr() sets the default timeout with some backends
+        cache.set(key, count, 2 * window)
@@ -1,4 +1,3 @@
-import crypt
 import json
 
 from django.conf import settings
@@ -6,9 +5,10 @@ from django.contrib import messages
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
-from django.shortcuts import render
-from django.utils.crypto import constant_time_compare
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.shortcuts import get_object_or_404, render
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import RedirectView, TemplateView, View
@@ -16,8 +16,10 @@ from django.views.generic.base import RedirectView, TemplateView, View
 from oidc_provider.models import UserConsent, Client
 
 from xorgauth.forms import PasswordChangeForm, PasswordResetForm, SetPasswordForm
+from xorgauth.utils.jsonstream import JSONStreamError
 
-from .models import User
+from . import axsync
+from .models import AxSyncJob, AxSyncSession
 
 
 @login_required
@@ -60,55 +62,137 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         return user.main_email if user.is_x_alumni() else None
 
 
+def check_ax_sync_configured():
+    # Do not do anything if no secret has been defined
+    if not settings.AX_SYNC_SECRET_CRYPT:
+        raise Http404("AX sync has not been configured")
+
+
+def load_ax_sync_request(request):
+    """Load and authenticate a small request of the AX data provider
+
+    Returns a tuple (data, error response).
+    """
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return None, HttpResponseBadRequest("Unable to load request")
+    if not isinstance(data, dict) or not axsync.check_secret(data.get('secret', '')):
+        return None, HttpResponseForbidden("Unauthenticated")
+    return data, None
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class SyncAxData(View):
     def post(self, request, *args, **kwargs):
         """Receive some data for syncing"""
-        # Do not do anything if no secret has been defined
-        if not settings.AX_SYNC_SECRET_CRYPT:
-            raise Http404("AX sync has not been configured")
+        check_ax_sync_configured()
 
+        # The request is parsed while it is read from the network, and
+        # contains a password for authenticating the data provider
         try:
-            data = json.loads(request.body.decode('ascii'))
-        except ValueError:
+            with transaction.atomic():
+                if settings.AX_SYNC_ASYNC_JOBS:
+                    result = axsync.enqueue_stream(request)
+                else:
+                    result = axsync.sync_stream(request)
+        except JSONStreamError:
             return HttpResponseBadRequest("Unable to load request")
-
-        # data['secret'] is a password for authenticating the data provider
-        digest = crypt.crypt(data.get('secret', ''), settings.AX_SYNC_SECRET_CRYPT)
-        if not constant_time_compare(digest, settings.AX_SYNC_SECRET_CRYPT):
+        except (KeyError, TypeError, ValueError, ValidationError):
+            return HttpResponseBadRequest("Unable to parse the request")
+        if result is None:
             return HttpResponseForbidden("Unauthenticated")
+        if settings.AX_SYNC_ASYNC_JOBS:
+            # The data will be synced by the runaxsyncjobs command
+            return JsonResponse(axsync.describe_job(result), status=202)
+        return HttpResponse("Sync OK: %s" % axsync.format_stats(result), status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxJobStatus(View):
+    def post(self, request, job_uid, *args, **kwargs):
+        """Describe the progress of a sync job"""
+        check_ax_sync_configured()
+        data, error_response = load_ax_sync_request(request)
+        if error_response is not None:
+            return error_response
+        job = get_object_or_404(AxSyncJob, uid=job_uid)
+        return JsonResponse(axsync.describe_job(job))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxWatermark(View):
+    def post(self, request, *args, **kwargs):
+        """Tell the date of the most recent update which has been synced"""
+        check_ax_sync_configured()
+        data, error_response = load_ax_sync_request(request)
+        if error_response is not None:
+            return error_response
+        return JsonResponse(axsync.get_watermark())
+
 
-        # Mapping from User model to value in JSON request
-        field_mapping = (
-            ('alumnforce_id', 'af_id'),
-            ('ax_contributor', 'ax_contributor'),
-            ('axjr_subscriber', 'axjr_subscribed'),
-            ('ax_last_synced', 'last_updated'),
-        )
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxSessionOpen(View):
+    def post(self, request, *args, **kwargs):
+        """Open a session for syncing data in several batches"""
+        check_ax_sync_configured()
+        data, error_response = load_ax_sync_request(request)
+        if error_response is not None:
+            return error_response
+        session = AxSyncSession.objects.create()
+        return JsonResponse(axsync.describe_session(session), status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxSessionStatus(View):
+    def post(self, request, session_uid, *args, **kwargs):
+        """Describe the batches which have been received in a session"""
+        check_ax_sync_configured()
+        data, error_response = load_ax_sync_request(request)
+        if error_response is not None:
+            return error_response
+        session = get_object_or_404(AxSyncSession, uid=session_uid)
+        return JsonResponse(axsync.describe_session(session))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxSessionBatch(View):
+    def post(self, request, session_uid, number, *args, **kwargs):
+        """Receive a batch of data in a session"""
+        check_ax_sync_configured()
         try:
-            for account_data in data['data']:
-                try:
-                    user = User.objects.get(hrid=account_data['xorg_id'])
-                except User.DoesNotExist:
-                    # Silently skip users that do not exist
-                    # If they are created, they will be synced the next time a
-                    # synchronisation request is sent to xorgauth.
-                    continue
-
-                # Change the account and commit the object only if there were some changes
-                changed = False
-                for model_field, json_field in field_mapping:
-                    if json_field not in account_data:
-                        continue
-                    new_value = account_data[json_field]
-                    if getattr(user, model_field) != new_value:
-                        setattr(user, model_field, new_value)
-                        changed = True
-                if changed:
-                    user.save()
-        except (KeyError, TypeError, ValueError):
+            batch = axsync.sync_session_batch(session_uid, int(number), request)
+        except AxSyncSession.DoesNotExist:
+            raise Http404("Unknown AX sync session")
+        except axsync.SessionCommitted:
+            return HttpResponse("Session already committed", status=409)
+        except JSONStreamError:
+            return HttpResponseBadRequest("Unable to load request")
+        except (KeyError, TypeError, ValueError, ValidationError):
             return HttpResponseBadRequest("Unable to parse the request")
-        return HttpResponse("Sync OK", status=200)
+        if batch is None:
+            return HttpResponseForbidden("Unauthenticated")
+        return JsonResponse(dict(axsync.batch_stats(batch), number=batch.number))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncAxSessionCommit(View):
+    def post(self, request, session_uid, *args, **kwargs):
+        """Commit a session, optionally checking that all the batches were received"""
+        check_ax_sync_configured()
+        data, error_response = load_ax_sync_request(request)
+        if error_response is not None:
+            return error_response
+        expected_batches = data.get('batches')
+        if expected_batches is not None and not isinstance(expected_batches, int):
+            return HttpResponseBadRequest("Unable to parse the request")
+        try:
+            session = axsync.commit_session(session_uid, expected_batches)
+        except AxSyncSession.DoesNotExist:
+            raise Http404("Unknown AX sync session")
+        except axsync.MissingBatches as exc:
+            return JsonResponse({'missing': exc.numbers}, status=409)
+        return JsonResponse(axsync.describe_session(session))
 
 
 if settings.MAINTENANCE:
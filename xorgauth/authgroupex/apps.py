@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class AuthgroupexConfig(AppConfig):
     name = 'xorgauth.authgroupex'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .checks import check_client_cache
+        checks.register(check_client_cache, checks.Tags.caches)
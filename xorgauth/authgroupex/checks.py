@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from xorgauth.utils import cache_versions
+
+
+def check_client_cache(app_configs, **kwargs):
+    """Warn when the processes cannot tell each other that AuthGroupeX clients changed"""
+    if not settings.AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE or \
+            cache_versions.is_shared(caches[settings.AUTHGROUPEX_CLIENT_CACHE]):
+        return []
+    return [checks.Warning(
+        "The cache %r is not shared between processes" % settings.AUTHGROUPEX_CLIENT_CACHE,
+        hint=(
+            "With several processes, a change of an AuthGroupeX client is only seen by the other processes "
+            "after cache.authgroupex_clients_max_age seconds (%d). Use a shared cache backend, "
+            "or set this option to 0 to load the clients for every request."
+        ) % settings.AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE,
+        id='authgroupex.W001',
+    )]
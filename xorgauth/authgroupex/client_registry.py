@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Keep the AuthGroupeX clients in the memory of each process
+
+Every process loads all the clients at once, with what is needed to answer
+requests: the private key, the compiled pattern of return URLs, the requested
+data fields and the allow_xnet flag. Looking up the client of a request then
+does not query the database.
+
+The clients are loaded again when a version (see xorgauth.utils.cache_versions)
+stored in a cache shared between processes changes. It is replaced when
+clients are created, modified or deleted (through signals) and when clients
+are imported. As the cache may lose the version, the clients are also loaded
+again when they are older than AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE seconds.
+When the cache is not shared between processes (with the locmem backend),
+this is the only way for a process to see the changes made by the others, so
+a system check warns about this configuration.
+"""
+import itertools
+import operator
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from xorgauth.utils import cache_versions
+
+from .models import (
+    AuthGroupeXClient, add_response_data, get_candidate_return_hosts, match_signed_challenge, parse_data_fields,
+)
+
+
+VERSION_KEY = 'xorgauth:authgroupex:version'
+
+# Loaded clients, as (version, load time, {return_host: [RegisteredClient, ...]})
+_registry = None
+
+
+class RegisteredClient(object):
+    """AuthGroupeX client loaded in the registry"""
+    def __init__(self, client):
+        self.pk = client.pk
+        self.name = client.name
+        self.privkey = client.privkey
+        self.return_urls_regex = client.get_return_urls_regex()
+        self.data_fields = parse_data_fields(client.data_fields)
+        self.allow_xnet = client.allow_xnet
+        self.last_used = client.last_used
+
+    def __str__(self):
+        return self.name
+
+    def match_return_url(self, url):
+        """Match the given url against the pattern for return URLS"""
+        return self.return_urls_regex.match(url)
+
+    def match_signed_challenge(self, gpex_challenge, gpex_pass):
+        """Verify that the challenge has been signed with the right key"""
+        return match_signed_challenge(self.privkey, gpex_challenge, gpex_pass)
+
+    def add_response_data(self, ext_url_params, user, gpex_challenge, gpex_group):
+        """Add user response data into the returned parameters"""
+        return add_response_data(self.privkey, self.data_fields, ext_url_params, user, gpex_challenge, gpex_group)
+
+    def update_last_used(self):
+        """Record that the client has been used today, if it has not been done yet"""
+        today = timezone.localdate()
+        if self.last_used != today:
+            # Do not send post_save, as it would make every process reload the clients
+            AuthGroupeXClient.objects.filter(pk=self.pk).update(last_used=today)
+            self.last_used = today
+
+
+def _get_cache():
+    return caches[settings.AUTHGROUPEX_CLIENT_CACHE]
+
+
+def invalidate():
+    """Make every process load the clients again"""
+    cache_versions.bump_version(_get_cache(), VERSION_KEY)
+
+
+def get_clients_by_host():
+    """Get the registered clients, grouped by their return_host, loading them if needed"""
+    global _registry
+    # Get the version before loading the clients, so that a change made while
+    # they are loaded makes them be loaded again on the next call
+    version = cache_versions.get_version(_get_cache(), VERSION_KEY)
+    now = time.time()
+    registry = _registry
+    if registry is not None:
+        loaded_version, loaded_at, clients_by_host = registry
+        if loaded_version == version and now - loaded_at < settings.AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE:
+            return clients_by_host
+    clients_by_host = {}
+    for client in AuthGroupeXClient.objects.order_by('pk'):
+        clients_by_host.setdefault(client.return_host, []).append(RegisteredClient(client))
+    _registry = (version, now, clients_by_host)
+    return clients_by_host
+
+
+def get_by_url_and_challenge(ext_url, gpex_challenge, gpex_pass):
+    """Get the registered client which matches the URL and signed the request
+
+    Like AuthGroupeXClient.objects.get_by_url_and_challenge, only the clients
+    whose return URLs can match the host of the URL are considered.
+    """
+    clients_by_host = get_clients_by_host()
+    candidates = sorted(
+        itertools.chain.from_iterable(clients_by_host.get(host, ()) for host in get_candidate_return_hosts(ext_url)),
+        key=operator.attrgetter('pk'))
+    for client in candidates:
+        if client.match_return_url(ext_url):
+            if client.match_signed_challenge(gpex_challenge, gpex_pass):
+                return client
@@ -2,6 +2,7 @@ import json
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand, CommandError
+from xorgauth.authgroupex import client_registry
 from xorgauth.authgroupex.models import AuthGroupeXClient
 
 
@@ -29,3 +30,6 @@ class Command(BaseCommand):
             client.return_urls = client_data['returnurls']
             client.allow_xnet = (client_data['flags'] == 'allow_xnet')
             client.save()
+
+        # Make every process load the imported clients
+        client_registry.invalidate()
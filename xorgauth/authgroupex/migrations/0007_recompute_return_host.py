@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:02
+
+import re
+
+from django.db import migrations
+
+
+# Copy of xorgauth.authgroupex.models.extract_return_host() at the time of this
+# migration, so that the migration keeps its behaviour when the model changes
+LITERAL_HOST_PATTERN_RE = re.compile(
+    r'^\^?'
+    r'(?:https?\??|http\(s\)\?|\(https?\??\)|\(http\|https\)|\(https\|http\))'
+    r'(?::|\\:)(?:/|\\/){2}'
+    r'(?:\((?:\?:)?www\\\.\)\?)?'
+    r'(?P<host>[A-Za-z0-9-]+(?:\\\.[A-Za-z0-9-]+)*)'
+    r'(?:/|\\/|\$)(?![?*{])'
+)
+
+
+def extract_return_host(return_urls):
+    pattern = return_urls.strip()
+    if pattern and pattern[0] == pattern[-1] == '#':
+        pattern = pattern[1:-1]
+    match = LITERAL_HOST_PATTERN_RE.match(pattern)
+    if match is None or '|' in pattern[match.end():]:
+        return ''
+    return match.group('host').replace('\\.', '.').lower()
+
+
+def forwards_func(apps, schema_editor):
+    """Patterns with an optional "/" after the host no longer have a return host"""
+    AuthGroupeXClient = apps.get_model('authgroupex', 'AuthGroupeXClient')
+    db_alias = schema_editor.connection.alias
+    for client in AuthGroupeXClient.objects.using(db_alias).only('return_urls', 'return_host').iterator():
+        return_host = extract_return_host(client.return_urls)
+        if client.return_host != return_host:
+            client.return_host = return_host
+            client.save(update_fields=['return_host'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authgroupex', '0006_add_return_host'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,7 @@ import sys
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.utils.six.moves.urllib.parse import urlparse
 from django.utils.translation import ugettext_lazy as _
 from xorgauth.utils.fields import UnboundedCharField
 
@@ -20,10 +21,143 @@ else:
         return x == y
 
 
+# Return URL patterns which only match URLs of a single host (or of this host
+# with "www." in front of it): a scheme, "://", the host with escaped dots,
+# and "/" or the end of the URL. The "/" cannot be optional (like in "/?"), as
+# the host could then be followed by other characters. With such a pattern,
+# the host of a matching URL is known, and the client can be found with an
+# index on this host.
+LITERAL_HOST_PATTERN_RE = re.compile(
+    r'^\^?'
+    r'(?:https?\??|http\(s\)\?|\(https?\??\)|\(http\|https\)|\(https\|http\))'
+    r'(?::|\\:)(?:/|\\/){2}'
+    r'(?:\((?:\?:)?www\\\.\)\?)?'
+    r'(?P<host>[A-Za-z0-9-]+(?:\\\.[A-Za-z0-9-]+)*)'
+    r'(?:/|\\/|\$)(?![?*{])'
+)
+
+
+def clean_return_urls_pattern(return_urls):
+    """Convert a pattern of return URLs to a Python regular expression"""
+    pattern = return_urls.strip()
+    # PHP's preg_match uses a special character at the beginning and the end
+    # of the pattern
+    if pattern and pattern[0] == pattern[-1] == '#':
+        pattern = pattern[1:-1]
+    return pattern
+
+
+def extract_return_host(return_urls):
+    """Extract the host of the URLs which can match a pattern of return URLs
+
+    Returns an empty string if the pattern can match several hosts.
+    """
+    pattern = clean_return_urls_pattern(return_urls)
+    match = LITERAL_HOST_PATTERN_RE.match(pattern)
+    # An alternation after the host may let the pattern match other hosts
+    if match is None or '|' in pattern[match.end():]:
+        return ''
+    return match.group('host').replace('\\.', '.').lower()
+
+
+def match_signed_challenge(privkey, gpex_challenge, gpex_pass):
+    """Verify that the challenge has been signed with the given private key"""
+    try:
+        computed_pass = hashlib.md5((gpex_challenge + privkey).encode('ascii')).hexdigest()
+    except UnicodeEncodeError:
+        return
+    return compare_digest(computed_pass, gpex_pass)
+
+
+def add_response_data(privkey, data_fields, ext_url_params, user, gpex_challenge, gpex_group):
+    """Add user response data into the returned parameters, signed with the private key of the client"""
+    try:
+        hashed_val = ('1' + gpex_challenge + privkey).encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    for data_field in data_fields:
+        val = None
+        if data_field == 'perms':
+            val = 'admin' if user.is_staff else 'user'
+        elif data_field == 'forlife':
+            val = user.hrid
+        elif data_field in ('prenom', 'firstname'):
+            val = user.firstname
+        elif data_field in ('nom', 'lastname'):
+            val = user.lastname
+        elif data_field == 'sex':
+            val = user.sex
+        elif data_field == 'matricule_ax':
+            val = user.axid
+        elif data_field == 'matricule':
+            val = user.schoolid
+        elif data_field == 'uid':
+            val = str(user.xorgdb_uid or '')
+        elif data_field == 'username':
+            val = user.main_email
+        elif data_field in ('promo', 'entry_year'):
+            val = user.study_year
+            while val and not '0' <= val[0] <= '9':
+                val = val[1:]
+        elif data_field == 'full_promo':
+            val = user.study_year
+        elif data_field in ('promo_sortie', 'grad_year'):
+            val = str(user.grad_year)
+        elif data_field == 'grpauth' and gpex_group:
+            try:
+                grp_membership = user.groups.get(group__shortname=gpex_group)
+                val = grp_membership.perms
+                if val == 'member':
+                    val = 'membre'
+            except ObjectDoesNotExist:
+                pass
+
+        if not val:
+            val = ''
+        ext_url_params[data_field] = val
+        try:
+            hashed_val += val.encode('utf-8')
+        except UnicodeEncodeError:
+            return False
+
+    # Sign the values
+    auth = hashlib.md5(hashed_val + b'1').hexdigest()
+    ext_url_params['auth'] = auth
+    return True
+
+
+def parse_data_fields(data_fields):
+    """Get the names of the fields requested by a client, in the order of the response"""
+    return tuple(data_fields.split(','))
+
+
+# Compiled return URL patterns of the clients, as {pk: (return_urls, regex)}
+_return_urls_regexes = {}
+
+
+def get_candidate_return_hosts(url):
+    """Get the values of AuthGroupeXClient.return_host of the clients which may match the URL"""
+    hosts = ['']
+    try:
+        host = urlparse(url).hostname
+    except ValueError:
+        host = None
+    if host:
+        hosts.append(host)
+        if host.startswith('www.'):
+            hosts.append(host[4:])
+    return hosts
+
+
 class AuthGroupeXClientManager(models.Manager):
     def get_by_url_and_challenge(self, ext_url, gpex_challenge, gpex_pass):
-        """Get the client which matches the URL and signed the request"""
-        for client in self.all():
+        """Get the client which matches the URL and signed the request
+
+        Only the clients whose return URLs can match the host of the URL
+        are considered, using the return_host column.
+        """
+        candidates = self.filter(return_host__in=get_candidate_return_hosts(ext_url)).order_by('pk')
+        for client in candidates:
             if client.match_return_url(ext_url):
                 if client.match_signed_challenge(gpex_challenge, gpex_pass):
                     return client
@@ -40,6 +174,8 @@ class AuthGroupeXClient(models.Model):
                                  help_text=_("Date of the last use of this client"))
     allow_xnet = models.BooleanField(_("allow xnet"), default=False,
                                      help_text=_("Allow account with type 'xnet' (external) to log in to this client"))
+    return_host = models.CharField(_("return host"), max_length=255, blank=True, db_index=True, editable=False,
+                                   help_text=_("Host of the return URLs, if they can only match a single host"))
 
     objects = AuthGroupeXClientManager()
 
@@ -50,75 +186,39 @@ class AuthGroupeXClient(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.return_host = extract_return_host(self.return_urls)
+        super(AuthGroupeXClient, self).save(*args, **kwargs)
+        _return_urls_regexes.pop(self.pk, None)
+
+    def delete(self, *args, **kwargs):
+        _return_urls_regexes.pop(self.pk, None)
+        return super(AuthGroupeXClient, self).delete(*args, **kwargs)
+
+    def get_return_urls_regex(self):
+        """Get the compiled pattern for return URLs
+
+        The compiled patterns are kept in the memory of the process, along
+        with the pattern they were compiled from, so that they are compiled
+        again when a client changes in another process.
+        """
+        cached = _return_urls_regexes.get(self.pk)
+        if cached is not None and cached[0] == self.return_urls:
+            return cached[1]
+        regex = re.compile(clean_return_urls_pattern(self.return_urls))
+        if self.pk is not None:
+            _return_urls_regexes[self.pk] = (self.return_urls, regex)
+        return regex
+
     def match_return_url(self, url):
         """Match the given url against the pattern for return URLS"""
-        pattern = self.return_urls.strip()
-        # PHP's preg_match uses a special character at the beginning and the end
-        # of the pattern
-        if pattern and pattern[0] == pattern[-1] == '#':
-            pattern = pattern[1:-1]
-        return re.match(pattern, url)
+        return self.get_return_urls_regex().match(url)
 
     def match_signed_challenge(self, gpex_challenge, gpex_pass):
         """Verify that the challenge has been signed with the right key"""
-        try:
-            computed_pass = hashlib.md5((gpex_challenge + self.privkey).encode('ascii')).hexdigest()
-        except UnicodeEncodeError:
-            return
-        return compare_digest(computed_pass, gpex_pass)
+        return match_signed_challenge(self.privkey, gpex_challenge, gpex_pass)
 
     def add_response_data(self, ext_url_params, user, gpex_challenge, gpex_group):
         """Add user response data into the returned parameters"""
-        try:
-            hashed_val = ('1' + gpex_challenge + self.privkey).encode('ascii')
-        except UnicodeEncodeError:
-            return False
-        for data_field in self.data_fields.split(','):
-            val = None
-            if data_field == 'perms':
-                val = 'admin' if user.is_staff else 'user'
-            elif data_field == 'forlife':
-                val = user.hrid
-            elif data_field in ('prenom', 'firstname'):
-                val = user.firstname
-            elif data_field in ('nom', 'lastname'):
-                val = user.lastname
-            elif data_field == 'sex':
-                val = user.sex
-            elif data_field == 'matricule_ax':
-                val = user.axid
-            elif data_field == 'matricule':
-                val = user.schoolid
-            elif data_field == 'uid':
-                val = str(user.xorgdb_uid or '')
-            elif data_field == 'username':
-                val = user.main_email
-            elif data_field in ('promo', 'entry_year'):
-                val = user.study_year
-                while val and not '0' <= val[0] <= '9':
-                    val = val[1:]
-            elif data_field == 'full_promo':
-                val = user.study_year
-            elif data_field in ('promo_sortie', 'grad_year'):
-                val = str(user.grad_year)
-            elif data_field == 'grpauth' and gpex_group:
-                try:
-                    grp_membership = user.groups.get(group__shortname=gpex_group)
-                    val = grp_membership.perms
-                    if val == 'member':
-                        val = 'membre'
-                except ObjectDoesNotExist:
-                    pass
-
-            if not val:
-                val = ''
-            ext_url_params[data_field] = val
-            try:
-                hashed_val += val.encode('utf-8')
-            except UnicodeEncodeError:
-                return False
-
-        # Sign the values
-        auth = hashlib.md5(hashed_val + b'1').hexdigest()
-        ext_url_params['auth'] = auth
-        return True
+        return add_response_data(self.privkey, parse_data_fields(self.data_fields),
+                                 ext_url_params, user, gpex_challenge, gpex_group)
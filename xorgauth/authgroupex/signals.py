@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import client_registry
+from .models import AuthGroupeXClient
+
+
+@receiver(post_save, sender=AuthGroupeXClient, dispatch_uid='xorgauth_authgroupex_client_registry')
+@receiver(post_delete, sender=AuthGroupeXClient, dispatch_uid='xorgauth_authgroupex_delete_client_registry')
+def invalidate_client_registry(sender, instance, **kwargs):
+    client_registry.invalidate()
+    # Other processes may have loaded the clients again before the change
+    # was committed
+    transaction.on_commit(client_registry.invalidate)
@@ -9,12 +9,11 @@ from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, QueryDict
 from django.urls import reverse
-from django.utils import timezone
 from django.views.generic import View
 
 from xorgauth import forms as xorgauth_forms
 
-from .models import AuthGroupeXClient
+from . import client_registry
 
 
 def extract_url_from_next_param(next_value, cut_length=120):
@@ -69,14 +68,12 @@ class AuthGroupeXView(LoginRequiredMixin, View):
             ext_url = 'http://' + ext_url
 
         # Get the client which signed the request
-        client = AuthGroupeXClient.objects.get_by_url_and_challenge(
-            ext_url, gpex_challenge, gpex_pass)
+        client = client_registry.get_by_url_and_challenge(ext_url, gpex_challenge, gpex_pass)
         if not client:
             return HttpResponseBadRequest('error: unknown client URL or bad challenge signature')
 
         # Update the last used date
-        client.last_used = timezone.now()
-        client.save()
+        client.update_last_used()
 
         # If the client does not allow external accounts, restrict access accordingly
         if not client.allow_xnet:
@@ -120,8 +117,7 @@ class AuthGroupeXLogoutView(View):
             ext_url = 'http://' + ext_url
 
         # Get the client which signed the request
-        client = AuthGroupeXClient.objects.get_by_url_and_challenge(
-            ext_url, gpex_challenge, gpex_pass)
+        client = client_registry.get_by_url_and_challenge(ext_url, gpex_challenge, gpex_pass)
         if not client:
             return HttpResponseBadRequest('error: unknown client URL or bad challenge signature')
 
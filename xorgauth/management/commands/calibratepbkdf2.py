@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import re
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.crypto import get_random_string
+from xorgauth.accounts.hashers import PBKDF2PasswordHasher, PBKDF2WrappedSHA1PasswordHasher
+
+
+def percentile(values, percent):
+    """Compute a percentile of some values, using the nearest-rank method"""
+    values = sorted(values)
+    rank = max(1, int(round(percent / 100. * len(values))))
+    return values[rank - 1]
+
+
+def update_ini_option(path, section, option, value):
+    """Set an option in an ini file, keeping the other lines and comments"""
+    try:
+        with io.open(path, 'r', encoding='utf-8') as fd:
+            lines = fd.read().splitlines()
+    except IOError:
+        lines = []
+
+    option_re = re.compile(r'^\s*' + re.escape(option) + r'\s*[=:]')
+    new_line = '%s = %s' % (option, value)
+    current_section = None
+    section_end = None
+    for idx, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            current_section = stripped[1:-1].strip()
+            if current_section == section and section_end is None:
+                # Insert the option right after the header of an empty section
+                section_end = idx + 1
+            continue
+        if current_section == section:
+            if option_re.match(line):
+                lines[idx] = new_line
+                break
+            if stripped:
+                section_end = idx + 1
+    else:
+        if section_end is not None:
+            lines.insert(section_end, new_line)
+        else:
+            if lines and lines[-1].strip():
+                lines.append('')
+            lines += ['[%s]' % section, new_line]
+
+    with io.open(path, 'w', encoding='utf-8') as fd:
+        fd.write('\n'.join(lines) + '\n')
+
+
+class Command(BaseCommand):
+    help = "Benchmark the PBKDF2 password hashers and recommend a number of iterations for a target latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=50.,
+                            help="target duration of a password verification, in milliseconds")
+        parser.add_argument('--percentile', type=float, default=95.,
+                            help="percentile of the durations which needs to meet the target")
+        parser.add_argument('--samples', type=int, default=20,
+                            help="number of verifications to time for each hasher")
+        parser.add_argument('--write', metavar='INIFILE', type=str,
+                            help="write the recommended number of iterations into this configuration file")
+
+    def benchmark(self, hasher, encode, iterations, samples):
+        """Time the verification of passwords with the given number of iterations"""
+        durations = []
+        for _ in range(samples):
+            password = get_random_string(16)
+            encoded = encode(hasher, password, iterations)
+            start = timeit.default_timer()
+            hasher.verify(password, encoded)
+            durations.append(timeit.default_timer() - start)
+        return durations
+
+    def handle(self, *args, **options):
+        target = options['target_ms'] / 1000.
+        if target <= 0 or options['samples'] <= 0 or not 0 < options['percentile'] <= 100:
+            raise CommandError("Invalid target, samples or percentile")
+
+        current_iterations = PBKDF2PasswordHasher().iterations
+        self.stdout.write("Current number of iterations: %d%s" % (
+            current_iterations,
+            '' if settings.PASSWORD_PBKDF2_ITERATIONS else " (Django's default)"))
+
+        benchmarks = (
+            (PBKDF2PasswordHasher(),
+             lambda hasher, password, iterations: hasher.encode(password, hasher.salt(), iterations)),
+            (PBKDF2WrappedSHA1PasswordHasher(),
+             lambda hasher, password, iterations: hasher.encode_sha1_hash(
+                 hashlib.sha1(password.encode('utf-8')).hexdigest(), hasher.salt(), iterations)),
+        )
+        recommendations = []
+        for hasher, encode in benchmarks:
+            durations = self.benchmark(hasher, encode, current_iterations, options['samples'])
+            duration = percentile(durations, options['percentile'])
+            # The duration of PBKDF2 is proportional to the number of iterations
+            recommended = int(current_iterations * target / duration) // 1000 * 1000
+            recommendations.append(recommended)
+            self.stdout.write("%s: p%g = %.1f ms with %d iterations, %d iterations for %g ms" % (
+                hasher.algorithm, options['percentile'], duration * 1000., current_iterations,
+                recommended, options['target_ms']))
+
+        # Both hashers use the same number of iterations: meet the target with the slowest one
+        recommended = max(1000, min(recommendations))
+        self.stdout.write("Recommended number of iterations: %d" % recommended)
+        if options['write']:
+            update_ini_option(options['write'], 'auth', 'pbkdf2_iterations', recommended)
+            self.stdout.write("Written into %s" % options['write'])
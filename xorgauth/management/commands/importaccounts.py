@@ -2,8 +2,8 @@
 from __future__ import unicode_literals
 import json
 
-from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand, CommandError
+from xorgauth.accounts import login_cache
 from xorgauth.accounts.hashers import PBKDF2WrappedSHA1PasswordHasher
 from xorgauth.accounts.models import User, UserAlias, Group, GroupMembership, Role
 
@@ -163,15 +163,20 @@ class Command(BaseCommand):
                 if changed:
                     membership.save()
 
-            # Import email aliases
+            # Import email aliases, with their local part used by logins
             current_user_aliases = set(a.email for a in user.aliases.all())
+            new_aliases = []
             for email in account_data['email_source'].keys():
                 email = email.lower()
                 if email in current_user_aliases:
                     continue
                 alias = UserAlias(user=user, email=email)
+                alias.update_local_part()
                 alias.full_clean()
-                alias.save()
+                new_aliases.append(alias)
+                current_user_aliases.add(email)
+            if new_aliases:
+                UserAlias.objects.bulk_create(new_aliases)
 
             user_roles = {role.pk for role in user.roles.all()}
 
@@ -183,3 +188,6 @@ class Command(BaseCommand):
             user_type_role = type_roles[account_data['type']]
             if user_type_role.pk not in user_roles:
                 user.roles.add(user_type_role)
+
+        # Aliases have been inserted in bulk, without sending signals
+        login_cache.invalidate()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from xorgauth.accounts import login_cache
+
+
+class Command(BaseCommand):
+    help = "Show the hit and miss counters of the cache of login lookups"
+
+    def handle(self, *args, **options):
+        if not settings.LOGIN_CACHE_STATS:
+            self.stderr.write("The counters are not updated, as cache.login_stats is disabled")
+        stats = login_cache.get_stats()
+        total = sum(stats.values())
+        for name in login_cache.STATS_NAMES:
+            ratio = 100. * stats[name] / total if total else 0.
+            self.stdout.write("%s: %d (%.1f%%)" % (name, stats[name], ratio))
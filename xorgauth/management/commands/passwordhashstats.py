@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+
+from django.contrib.auth.hashers import get_hasher, identify_hasher, is_password_usable
+from django.core.management.base import BaseCommand
+from xorgauth.accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "Report how many password hashes use each algorithm and how many need to be upgraded"
+
+    def handle(self, *args, **options):
+        preferred = get_hasher('default')
+        counts = collections.Counter()
+        outdated = collections.Counter()
+        for encoded in User.objects.values_list('password', flat=True).iterator():
+            if not is_password_usable(encoded):
+                counts['(unusable)'] += 1
+                continue
+            try:
+                hasher = identify_hasher(encoded)
+            except ValueError:
+                counts['(unknown)'] += 1
+                continue
+            counts[hasher.algorithm] += 1
+            if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+                outdated[hasher.algorithm] += 1
+
+        self.stdout.write("Preferred algorithm: %s" % preferred.algorithm)
+        for algorithm, count in sorted(counts.items()):
+            line = "%s: %d" % (algorithm, count)
+            if outdated[algorithm]:
+                line += " (%d to be upgraded at next login)" % outdated[algorithm]
+            self.stdout.write(line)
+        self.stdout.write("Total to be upgraded: %d/%d" % (sum(outdated.values()), sum(counts.values())))
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from xorgauth.accounts import axsync
+
+
+class Command(BaseCommand):
+    help = "Delete the records of the changes made by the AX sync, and the sync sessions and jobs, which are too old"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="number of days to keep (default: ax_sync.log_retention_days)")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = settings.AX_SYNC_LOG_RETENTION_DAYS
+        num_changes, num_sessions, num_jobs = axsync.prune_log(days)
+        self.stdout.write("Deleted %d change records, %d sessions and %d jobs older than %d days" % (
+            num_changes, num_sessions, num_jobs, days))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from xorgauth.accounts.hashers import PBKDF2WrappedSHA1PasswordHasher, ScryptWrappedSHA1PasswordHasher
+from xorgauth.accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the pbkdf2_wrapped_sha1 password hashes of imported accounts to scrypt_wrapped_sha1, "
+        "using the SHA1 hashes from a JSON file in the format of importaccounts. "
+        "Sessions are bound to the password hash, so the users whose hash is converted are logged out "
+        "and need to log in again; use --limit to spread the conversion over several runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('jsonfile', nargs=1, type=str,
+                            help="path to JSON file to load")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="only report which hashes would be converted")
+        parser.add_argument('--limit', type=int, default=0,
+                            help="maximal number of hashes to convert (and of users to log out) in this run")
+
+    def handle(self, *args, **options):
+        is_verbose = int(options['verbosity']) >= 2
+        with open(options['jsonfile'][0], 'r') as jsonfd:
+            jsondata = json.load(jsonfd)
+        if 'accounts' not in jsondata:
+            raise CommandError("Unable to find account entries")
+        sha1_hashes = {
+            account_data['hruid']: account_data['password']
+            for account_data in jsondata['accounts']
+            if account_data.get('password')
+        }
+
+        pbkdf2_hasher = PBKDF2WrappedSHA1PasswordHasher()
+        scrypt_hasher = ScryptWrappedSHA1PasswordHasher()
+        prefix = pbkdf2_hasher.algorithm + '$'
+        users = User.objects.filter(password__startswith=prefix).only('hrid', 'password')
+        num_converted = num_mismatched = num_missing = 0
+        for user in users.iterator():
+            if options['limit'] and num_converted >= options['limit']:
+                break
+            sha1_hash = sha1_hashes.get(user.hrid)
+            if sha1_hash is None:
+                num_missing += 1
+                continue
+
+            # Only convert the hash if it really wraps the SHA1 hash from the JSON file
+            algorithm, iterations, salt, digest = user.password.split('$', 3)
+            if pbkdf2_hasher.encode_sha1_hash(sha1_hash, salt, int(iterations)) != user.password:
+                num_mismatched += 1
+                if is_verbose:
+                    print("... the password of %s does not match the SHA1 hash" % user.hrid)
+                continue
+
+            num_converted += 1
+            if is_verbose:
+                print("Converting the password of %s" % user.hrid)
+            if not options['dry_run']:
+                # Do not send signals: this is not a password change, even though the
+                # sessions of the user are invalidated as the hash changes
+                User.objects.filter(pk=user.pk, password=user.password).update(
+                    password=scrypt_hasher.encode_sha1_hash(sha1_hash))
+
+        self.stdout.write("%d converted, %d not matching, %d missing from the JSON file" % (
+            num_converted, num_mismatched, num_missing))
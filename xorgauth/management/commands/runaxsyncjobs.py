@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from xorgauth.accounts import axsync
+
+
+class Command(BaseCommand):
+    help = "Apply the AX sync jobs which have been received with ax_sync.async_jobs enabled"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="run the pending jobs and exit, instead of waiting for new jobs")
+        parser.add_argument('--interval', type=float, default=10.,
+                            help="number of seconds between checks for new jobs (default: 10)")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            jobs = axsync.run_pending_jobs()
+            for job in jobs:
+                self.stdout.write("Job %s %s: %d/%d entries, %d updated, %d unchanged, %d unknown%s" % (
+                    job.uid, job.status, job.processed, job.entries, job.updated, job.unchanged, job.unknown,
+                    " (%s)" % job.error if job.error else ""))
+            if options['once']:
+                return
+            if not jobs:
+                time.sleep(options['interval'])
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) Polytechnique.org
 # This code is distributed under the Affero General Public License version 3
+from django.http import HttpResponse
+
+from xorgauth.accounts.passwords import PasswordCheckOverloaded
+from xorgauth.accounts.throttling import LoginThrottled
 
 
 class AXOIDCFixerMiddleware:
@@ -31,3 +35,29 @@ class AXOIDCFixerMiddleware:
                         new_get.appendlist(good_key, value)
             request.GET = new_get
         return self.get_response(request)
+
+
+class LoginOverloadMiddleware:
+    """
+    Middleware used for answering "429 Too Many Requests" when too many
+    password verifications are in progress or when too many login attempts
+    failed recently.
+
+    This lets login floods degrade gracefully instead of keeping every worker
+    busy computing password hashes.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, PasswordCheckOverloaded):
+            response = HttpResponse("Too many login attempts in progress, please try again later.", status=429)
+            response['Retry-After'] = '1'
+            return response
+        if isinstance(exception, LoginThrottled):
+            response = HttpResponse("Too many failed login attempts, please try again later.", status=429)
+            response['Retry-After'] = str(exception.retry_after)
+            return response
@@ -52,7 +52,7 @@ ALLOWED_HOSTS = config.getlist('site.allowed_hosts', [])
 INSTALLED_APPS = [
     'xorgauth.accounts.apps.AccountsConfig',
     'xorgauth',
-    'xorgauth.authgroupex',
+    'xorgauth.authgroupex.apps.AuthgroupexConfig',
     'xorgauth.relying_party_test',
     'django.contrib.admin',
     'django.contrib.contenttypes',
@@ -69,6 +69,29 @@ AUTHENTICATION_BACKENDS = [
     'xorgauth.accounts.authentication.XorgBackend'
 ]
 
+# Number of threads running database queries and password verifications for
+# xorgauth.accounts.async_authentication, in ASGI deployments
+AUTH_THREAD_POOL_SIZE = config.getint('auth.thread_pool_size', 4)
+
+# Maximal number of password verifications computed at the same time by the
+# processes sharing the cache of the logins, before answering "429 Too Many
+# Requests" (0 to disable the limit)
+AUTH_PASSWORD_CHECK_LIMIT = config.getint('auth.password_check_limit', 0)
+
+# Make login attempts with unknown usernames last as long as password verifications
+AUTH_EQUALIZE_TIMING = config.getbool('auth.equalize_timing', False)
+
+# Maximal numbers of failed login attempts for a login identifier and from an
+# IP address in a sliding window (in seconds), 0 to disable the limit
+LOGIN_THROTTLE_WINDOW = config.getint('auth.throttle_window', 300)
+LOGIN_THROTTLE_PER_LOGIN = config.getint('auth.throttle_per_login', 0)
+LOGIN_THROTTLE_PER_IP = config.getint('auth.throttle_per_ip', 0)
+# Number of reverse proxies which append the client IP address to the
+# X-Forwarded-For header (0 to use the address of the peer)
+TRUSTED_PROXIES = config.getint('auth.trusted_proxies', 0)
+if LOGIN_THROTTLE_WINDOW <= 0:
+    raise ImproperlyConfigured("The login throttling window must be a positive number of seconds")
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,6 +99,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'xorgauth.middleware.AXOIDCFixerMiddleware',
+    'xorgauth.middleware.LoginOverloadMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -149,6 +173,50 @@ if _engine == 'mysql':
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+_CACHE_BACKEND_MAP = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'memcached': 'django.core.cache.backends.memcached.MemcachedCache',
+}
+_cache_backend = config.getstr('cache.backend', 'locmem')
+if _cache_backend not in _CACHE_BACKEND_MAP:
+    raise ImproperlyConfigured(
+        "Cache backend %s is unknown; please choose from %s" %
+        (_cache_backend, ', '.join(sorted(_CACHE_BACKEND_MAP.keys())))
+    )
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Results of login lookups, shared between processes unless using locmem
+    'logins': {
+        'BACKEND': _CACHE_BACKEND_MAP[_cache_backend],
+        'LOCATION': config.getstr('cache.location', 'xorgauth-logins'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config.getint('cache.max_entries', 10000),
+        },
+    },
+}
+
+# Cache alias and durations (in seconds, 0 to disable) of the results of login
+# lookups: user IDs of known login identifiers, and unknown login identifiers
+LOGIN_CACHE = 'logins'
+LOGIN_CACHE_TIMEOUT = config.getint('cache.login_timeout', 0)
+LOGIN_NEGATIVE_CACHE_TIMEOUT = config.getint('cache.login_negative_timeout', 60)
+# Whether the hits and misses of the login cache are counted (see logincachestats)
+LOGIN_CACHE_STATS = config.getbool('cache.login_stats', False)
+
+# Cache alias of the version of the AuthGroupeX clients loaded by each process,
+# and how long (in seconds) a process uses them before loading them again
+AUTHGROUPEX_CLIENT_CACHE = 'logins'
+AUTHGROUPEX_CLIENT_REGISTRY_MAX_AGE = config.getint('cache.authgroupex_clients_max_age', 60)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -180,10 +248,21 @@ AUTH_PASSWORD_VALIDATORS = [
 # Password hashers
 # https://docs.djangoproject.com/en/1.11/ref/settings/#password-hashers
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'xorgauth.accounts.hashers.PBKDF2PasswordHasher',
     'xorgauth.accounts.hashers.PBKDF2WrappedSHA1PasswordHasher',
+    'xorgauth.accounts.hashers.ScryptWrappedSHA1PasswordHasher',
 ]
 
+# Number of PBKDF2 iterations (0 for Django's default), which can be computed
+# with "manage.py calibratepbkdf2"
+PASSWORD_PBKDF2_ITERATIONS = config.getint('auth.pbkdf2_iterations', 0)
+
+# Cost parameters of scrypt for the SHA1 hashes of imported accounts: each hash
+# uses 128 * work_factor * block_size bytes of memory (16 MB by default)
+PASSWORD_SCRYPT_WORK_FACTOR = config.getint('auth.scrypt_work_factor', 2 ** 14)
+PASSWORD_SCRYPT_BLOCK_SIZE = config.getint('auth.scrypt_block_size', 8)
+PASSWORD_SCRYPT_PARALLELISM = config.getint('auth.scrypt_parallelism', 1)
+
 # Password validators
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -192,6 +271,13 @@ AUTH_PASSWORD_VALIDATORS = [
     }
 ]
 
+# Background threads running the tasks deferred after transactions commit
+# (xorgauth.utils.deferred), or run these tasks immediately if eager
+DEFERRED_TASKS_WORKERS = config.getint('app.deferred_tasks_workers', 2)
+DEFERRED_TASKS_EAGER = config.getbool('app.deferred_tasks_eager', False)
+# Maximal duration (in seconds) to wait for the deferred tasks when exiting
+DEFERRED_TASKS_EXIT_TIMEOUT = config.getint('app.deferred_tasks_exit_timeout', 10)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
@@ -239,6 +325,14 @@ EMAIL_SUBJECT_PREFIX = config.getstr('email.subject_prefix', '[Django xorgauth]'
 
 # Sync with data from AX website (xorgdata)
 AX_SYNC_SECRET_CRYPT = config.getstr("ax_sync.secret_crypt")
+# How long a verified sync secret is remembered, in seconds (0 to disable)
+AX_SYNC_SECRET_CACHE_TIMEOUT = config.getint("ax_sync.secret_cache_timeout", 300)
+# How long the changes made by the sync are kept, in days (see the pruneaxsynclog command)
+AX_SYNC_LOG_RETENTION_DAYS = config.getint("ax_sync.log_retention_days", 365)
+# Whether the sync requests are stored in jobs, which are run by the runaxsyncjobs command
+AX_SYNC_ASYNC_JOBS = config.getbool("ax_sync.async_jobs", False)
+# Maximal size of a sync request, in bytes (0 to disable the limit)
+AX_SYNC_MAX_REQUEST_SIZE = config.getint("ax_sync.max_request_size", 100 * 1024 * 1024)
 
 # In development mode, send messages to the console
 if APPMODE == 'dev':
@@ -53,6 +53,16 @@ urlpatterns = [
     url(r'^auth-groupex-login$', authgpx_views.AuthGroupeXLoginView.as_view(), name='auth-groupex-login'),
     url(r'^auth-groupex-logout$', authgpx_views.AuthGroupeXLogoutView.as_view(), name='auth-groupex-logout'),
     url(r'^sync/axdata$', xorgauth_views.SyncAxData.as_view(), name='sync-ax-data'),
+    url(r'^sync/axdata/jobs/(?P<job_uid>[0-9a-f-]{36})$', xorgauth_views.SyncAxJobStatus.as_view(),
+        name='sync-ax-job'),
+    url(r'^sync/axdata/watermark$', xorgauth_views.SyncAxWatermark.as_view(), name='sync-ax-watermark'),
+    url(r'^sync/axdata/sessions$', xorgauth_views.SyncAxSessionOpen.as_view(), name='sync-ax-session-open'),
+    url(r'^sync/axdata/sessions/(?P<session_uid>[0-9a-f-]{36})$', xorgauth_views.SyncAxSessionStatus.as_view(),
+        name='sync-ax-session'),
+    url(r'^sync/axdata/sessions/(?P<session_uid>[0-9a-f-]{36})/batches/(?P<number>[0-9]{1,9})$',
+        xorgauth_views.SyncAxSessionBatch.as_view(), name='sync-ax-session-batch'),
+    url(r'^sync/axdata/sessions/(?P<session_uid>[0-9a-f-]{36})/commit$', xorgauth_views.SyncAxSessionCommit.as_view(),
+        name='sync-ax-session-commit'),
     url(r'^faq$', TemplateView.as_view(template_name='faq.html'), name='faq'),
     url(r'^test-relying-party/$', rptest_views.RelyingParty.as_view(), name='test-relying-party'),
 ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Versions stored in a cache, to tell processes that some data changed
+
+A version is a random token rather than a counter, so that it does not take a
+value which was already used when it is evicted from the cache: data tagged
+with an old version never becomes valid again.
+"""
+import uuid
+
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def get_version(cache, key):
+    """Get the version stored in the cache, setting a new one if there is none"""
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        cache.add(key, version, None)
+        # Another process may have set the version in the meantime
+        version = cache.get(key, version)
+    return version
+
+
+def bump_version(cache, key):
+    """Replace the version stored in the cache with a new one"""
+    # Do not use incr(), which sets the default timeout with some backends
+    cache.set(key, new_version(), None)
+
+
+def is_shared(cache):
+    """Tell whether the cache can be shared between processes"""
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Run tasks in background threads once the current transaction is committed
+
+This keeps expensive work which is not needed for the response (like hashing
+a password in another format) out of the request/response cycle, without
+depending on an external job queue. The tasks are kept in memory, so that
+their arguments (which can be secrets such as passwords) are never written
+to the database.
+
+Tasks deferred with defer_in_order() and the same key (like the primary key of
+a user) run one after another, in the order they were deferred, even when
+there are several worker threads.
+
+When the setting DEFERRED_TASKS_EAGER is enabled, tasks are run immediately
+in the calling thread, which is useful for tests and management commands.
+
+As nothing is persisted, deferred tasks can be lost: when the process exits,
+the pending tasks are given DEFERRED_TASKS_EXIT_TIMEOUT seconds to complete,
+and the tasks which did not start by then are dropped (with a warning). The
+tasks of a process which is killed or crashes are all lost. So tasks must only
+do work which can be redone later, like upgrading a password hash at the next
+login.
+"""
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+# Tasks waiting for the running task with the same key, as {key: [(func, args, kwargs), ...]}
+_ordered = {}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.DEFERRED_TASKS_WORKERS)
+        return _executor
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    start = time.time()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Deferred task %r failed", func)
+    else:
+        logger.debug("Deferred task %r finished in %.3fs", func, time.time() - start)
+    finally:
+        close_old_connections()
+
+
+def _run_in_order(key, func, args, kwargs):
+    while True:
+        _run(func, args, kwargs)
+        with _executor_lock:
+            waiting = _ordered[key]
+            if not waiting:
+                del _ordered[key]
+                return
+            func, args, kwargs = waiting.pop(0)
+
+
+def _submit(func, args, kwargs):
+    logger.debug("Submitting deferred task %r", func)
+    future = _get_executor().submit(_run, func, args, kwargs)
+    _track(future)
+
+
+def _submit_in_order(key, func, args, kwargs):
+    logger.debug("Submitting deferred task %r with key %r", func, key)
+    with _executor_lock:
+        if key in _ordered:
+            # The running task with this key will run this one afterwards
+            _ordered[key].append((func, args, kwargs))
+            return
+        _ordered[key] = []
+    _track(_get_executor().submit(_run_in_order, key, func, args, kwargs))
+
+
+def _track(future):
+    with _executor_lock:
+        _pending.add(future)
+    future.add_done_callback(_discard)
+
+
+def _discard(future):
+    with _executor_lock:
+        _pending.discard(future)
+
+
+def defer(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a background thread after the current transaction commits"""
+    if settings.DEFERRED_TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    logger.debug("Deferring task %r until the transaction commits", func)
+    transaction.on_commit(lambda: _submit(func, args, kwargs))
+
+
+def defer_in_order(key, func, *args, **kwargs):
+    """Like defer(), but run the tasks with the same key one after another, in order"""
+    if settings.DEFERRED_TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    logger.debug("Deferring task %r with key %r until the transaction commits", func, key)
+    transaction.on_commit(lambda: _submit_in_order(key, func, args, kwargs))
+
+
+def wait_for_tasks(timeout=None):
+    """Wait for the submitted tasks to complete
+
+    Returns the number of tasks which did not complete before the timeout.
+    """
+    with _executor_lock:
+        futures = list(_pending)
+    return len(wait(futures, timeout=timeout).not_done)
+
+
+@atexit.register
+def _wait_at_exit():
+    if not _pending:
+        return
+    logger.info("Waiting for %d deferred tasks before exiting", len(_pending))
+    not_done = wait_for_tasks(timeout=settings.DEFERRED_TASKS_EXIT_TIMEOUT)
+    if not_done:
+        logger.warning("Exiting with %d deferred tasks which did not complete", not_done)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""Incremental parsing of a JSON document read from a stream
+
+JSONStreamReader reads a file-like object (such as a Django request) by
+chunks, and lets the caller walk through the containers of the document while
+only decoding the values it needs. For example, the items of a long array can
+be processed one at a time, without loading the whole document in memory.
+The size of the document and of the values which are decoded at once can be
+limited, as the stream may come from an untrusted client.
+"""
+import codecs
+import json
+
+
+READ_CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = ' \t\n\r'
+VALUE_DELIMITERS = JSON_WHITESPACE + ',:]}'
+
+
+class JSONStreamError(ValueError):
+    """The stream does not contain a valid JSON document"""
+
+
+class JSONStreamReader(object):
+    """Read the JSON document contained in a file-like object, piece by piece"""
+    def __init__(self, stream, chunk_size=READ_CHUNK_SIZE, encoding='utf-8', max_size=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self._size = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read_chunk(self):
+        """Append a chunk of the stream to the buffer, and return False at the end of the stream"""
+        if self._eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self._size += len(chunk)
+        if self.max_size is not None and self._size > self.max_size:
+            raise JSONStreamError("The document is larger than %d bytes" % self.max_size)
+        try:
+            if chunk:
+                text = self._decoder.decode(chunk)
+            else:
+                self._eof = True
+                text = self._decoder.decode(b'', final=True)
+        except UnicodeDecodeError as exc:
+            raise JSONStreamError("Invalid encoding: %s" % exc)
+        # Drop what has already been parsed
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and get the next character, or an empty string at the end of the document"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in JSON_WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_chunk():
+                return ''
+
+    def _expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise JSONStreamError("Expected one of %r, got %r" % (chars, char))
+        self._pos += 1
+        return char
+
+    def _check_value_size(self, size, max_size):
+        if max_size is not None and size > max_size:
+            raise JSONStreamError("Value larger than %d characters" % max_size)
+
+    def read_value(self, max_size=None):
+        """Decode the next value, which can be limited to max_size characters"""
+        self.peek()
+        # Number of characters to read before trying to decode the value again
+        needed = 0
+        while True:
+            available = len(self._buffer) - self._pos
+            if available < needed and self._read_chunk():
+                continue
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except ValueError as exc:
+                # The value may be truncated by the end of the buffer
+                if self._eof:
+                    raise JSONStreamError(str(exc))
+                self._check_value_size(available, max_size)
+                # Wait for twice as much data, so that a long value is not
+                # decoded again after each chunk
+                needed = max(2 * available, available + 1)
+                continue
+            self._check_value_size(end - self._pos, max_size)
+            # A number which is not followed by a delimiter may continue in the next chunk
+            if (end < len(self._buffer) and self._buffer[end] in VALUE_DELIMITERS) or not self._read_chunk():
+                self._pos = end
+                return value
+
+    def iter_object(self):
+        """Iterate over the keys of the next object
+
+        The caller needs to consume the value associated with each key (with
+        read_value() or iter_array()) before getting the next key.
+        """
+        self._expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise JSONStreamError("Expected an object key")
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def iter_array(self):
+        """Iterate over the values of the next array"""
+        self._expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._expect(',]') == ']':
+                return
+
+    def check_end(self):
+        """Ensure that nothing but whitespace follows the document"""
+        if self.peek():
+            raise JSONStreamError("Extra data after the JSON document")
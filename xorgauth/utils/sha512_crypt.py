@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polytechnique.org
+# This code is distributed under the Affero General Public License version 3
+"""SHA-512-based crypt ("$6$" hashes), without Python's crypt module
+
+The crypt module is deprecated since Python 3.11 and removed in Python 3.13.
+This is an implementation of the algorithm specified by Ulrich Drepper in
+https://www.akkadia.org/drepper/SHA-crypt.txt, which produces the same
+hashes as crypt(3) from the GNU C Library. The functions only use their
+arguments, so they can also be run in a process pool.
+"""
+import hashlib
+import random
+
+from django.utils.encoding import force_bytes
+
+
+PREFIX = '$6$'
+ROUNDS_PREFIX = 'rounds='
+ROUNDS_DEFAULT = 5000
+ROUNDS_MIN = 1000
+ROUNDS_MAX = 999999999
+SALT_MAX_LENGTH = 16
+
+ITOA64 = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# Order of the bytes of the final digest in the encoded hash
+_DIGEST_TRIPLETS = (
+    (0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4), (47, 5, 26), (6, 27, 48),
+    (28, 49, 7), (50, 8, 29), (9, 30, 51), (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13),
+    (56, 14, 35), (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19), (62, 20, 41),
+)
+
+
+def _repeat_digest(digest, length):
+    """Repeat a digest until it reaches the given length"""
+    return (digest * (length // len(digest) + 1))[:length]
+
+
+def _b64_from_24bit(byte2, byte1, byte0, num_chars):
+    value = (byte2 << 16) | (byte1 << 8) | byte0
+    chars = []
+    for _ in range(num_chars):
+        chars.append(ITOA64[value & 0x3f])
+        value >>= 6
+    return ''.join(chars)
+
+
+def parse_setting(setting):
+    """Get the number of rounds, whether it was explicit, and the salt from a "$6$" setting or hash"""
+    if not setting.startswith(PREFIX):
+        raise ValueError("Not a SHA-512 crypt setting")
+    setting = setting[len(PREFIX):]
+    rounds = ROUNDS_DEFAULT
+    rounds_custom = False
+    if setting.startswith(ROUNDS_PREFIX):
+        rounds_str, sep, rest = setting[len(ROUNDS_PREFIX):].partition('$')
+        if sep and rounds_str.isdigit():
+            rounds = min(max(int(rounds_str), ROUNDS_MIN), ROUNDS_MAX)
+            rounds_custom = True
+            setting = rest
+    salt = setting.split('$', 1)[0][:SALT_MAX_LENGTH]
+    return rounds, rounds_custom, salt
+
+
+def sha512_crypt(password, setting):
+    """Compute crypt(password, setting) for a setting (or hash) starting with "$6$"
+
+    This is equivalent to crypt.crypt(password, setting) with glibc.
+    """
+    rounds, rounds_custom, salt = parse_setting(setting)
+    key = force_bytes(password)
+    salt_bytes = force_bytes(salt)
+
+    digest_b = hashlib.sha512(key + salt_bytes + key).digest()
+
+    ctx = hashlib.sha512(key + salt_bytes)
+    ctx.update(_repeat_digest(digest_b, len(key)))
+    length = len(key)
+    while length:
+        ctx.update(digest_b if length & 1 else key)
+        length >>= 1
+    digest_a = ctx.digest()
+
+    p_bytes = _repeat_digest(hashlib.sha512(key * len(key)).digest(), len(key))
+    s_bytes = _repeat_digest(hashlib.sha512(salt_bytes * (16 + bytearray(digest_a)[0])).digest(), len(salt_bytes))
+
+    for i in range(rounds):
+        ctx = hashlib.sha512(p_bytes if i & 1 else digest_a)
+        if i % 3:
+            ctx.update(s_bytes)
+        if i % 7:
+            ctx.update(p_bytes)
+        ctx.update(digest_a if i & 1 else p_bytes)
+        digest_a = ctx.digest()
+
+    final = bytearray(digest_a)
+    encoded = ''.join(_b64_from_24bit(final[a], final[b], final[c], 4) for a, b, c in _DIGEST_TRIPLETS)
+    encoded += _b64_from_24bit(0, 0, final[63], 2)
+
+    result = PREFIX
+    if rounds_custom:
+        result += '%s%d$' % (ROUNDS_PREFIX, rounds)
+    return result + salt + '$' + encoded
+
+
+def make_setting(rounds=None):
+    """Generate a random "$6$" setting, like crypt.mksalt(crypt.METHOD_SHA512)"""
+    rng = random.SystemRandom()
+    salt = ''.join(rng.choice(ITOA64) for _ in range(SALT_MAX_LENGTH))
+    if rounds is None:
+        return PREFIX + salt
+    return '%s%s%d$%s' % (PREFIX, ROUNDS_PREFIX, rounds, salt)